@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+#
+# Compares the speed of XMLEncoderAdapter against the XMLGenerator-based
+# adapter it replaced, using a payload similar to a large API list response.
+
+from __future__ import print_function, unicode_literals
+
+import os
+import sys
+import timeit
+from xml.sax.saxutils import XMLGenerator
+
+scripts_dir = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(scripts_dir, '..', '..')))
+
+from django.conf import settings
+settings.configure(DEFAULT_CHARSET='utf-8')
+
+from django.utils import six
+
+from djblets.util.compat.six.moves import cStringIO as StringIO
+from djblets.webapi.core import WebAPIEncoder, XMLEncoderAdapter
+
+
+class SAXXMLEncoderAdapter(object):
+    """The original XMLGenerator-based implementation of XMLEncoderAdapter."""
+    def __init__(self, encoder, *args, **kwargs):
+        self.encoder = encoder
+
+    def encode(self, o, *args, **kwargs):
+        self.level = 0
+        self.doIndent = False
+
+        stream = StringIO()
+        self.xml = XMLGenerator(stream, settings.DEFAULT_CHARSET)
+        self.xml.startDocument()
+        self.startElement("rsp")
+        self.__encode(o, *args, **kwargs)
+        self.endElement("rsp")
+        self.xml.endDocument()
+        self.xml = None
+
+        return stream.getvalue()
+
+    def __encode(self, o, *args, **kwargs):
+        if isinstance(o, dict):
+            for key, value in six.iteritems(o):
+                attrs = {}
+
+                if isinstance(key, six.integer_types):
+                    attrs['value'] = str(key)
+                    key = 'int'
+
+                self.startElement(key, attrs)
+                self.__encode(value, *args, **kwargs)
+                self.endElement(key)
+        elif isinstance(o, (tuple, list)):
+            self.startElement("array")
+
+            for i in o:
+                self.startElement("item")
+                self.__encode(i, *args, **kwargs)
+                self.endElement("item")
+
+            self.endElement("array")
+        elif isinstance(o, six.string_types):
+            self.text(o)
+        elif isinstance(o, six.integer_types):
+            self.text("%d" % o)
+        elif isinstance(o, bool):
+            if o:
+                self.text("True")
+            else:
+                self.text("False")
+        elif o is None:
+            pass
+        else:
+            result = self.encoder.encode(o, *args, **kwargs)
+
+            if result is None:
+                raise TypeError("%r is not XML serializable" % (o,))
+
+            return self.__encode(result, *args, **kwargs)
+
+    def startElement(self, name, attrs={}):
+        self.addIndent()
+        self.xml.startElement(name, attrs)
+        self.level += 1
+        self.doIndent = True
+
+    def endElement(self, name):
+        self.level -= 1
+        self.addIndent()
+        self.xml.endElement(name)
+        self.doIndent = True
+
+    def text(self, value):
+        self.xml.characters(value)
+        self.doIndent = False
+
+    def addIndent(self):
+        if self.doIndent:
+            self.xml.ignorableWhitespace('\n' + ' ' * self.level)
+
+
+def build_payload(num_items):
+    return {
+        'stat': 'ok',
+        'total_results': num_items,
+        'links': {
+            'self': {
+                'method': 'GET',
+                'href': 'http://example.com/api/items/',
+            },
+        },
+        'items': [
+            {
+                'id': i,
+                'summary': 'Item <%d> & "friends"' % i,
+                'description': 'A longer description of the item. ' * 10,
+                'public': i % 2 == 0,
+                'extra_data': None,
+                'tags': ['tag%d' % j for j in range(5)],
+                'counts': {j: j * i for j in range(3)},
+                'links': {
+                    'self': {
+                        'method': 'GET',
+                        'href': 'http://example.com/api/items/%d/' % i,
+                    },
+                    'delete': {
+                        'method': 'DELETE',
+                        'href': 'http://example.com/api/items/%d/' % i,
+                    },
+                },
+            }
+            for i in range(num_items)
+        ],
+    }
+
+
+if __name__ == '__main__':
+    payload = build_payload(200)
+    encoder = WebAPIEncoder()
+    old_adapter = SAXXMLEncoderAdapter(encoder)
+    new_adapter = XMLEncoderAdapter(encoder)
+    unindented_adapter = XMLEncoderAdapter(encoder, indent=False)
+
+    if old_adapter.encode(payload) != new_adapter.encode(payload):
+        print('The encoded XML does not match the original adapter.')
+        sys.exit(1)
+
+    runs = 20
+    results = [
+        ('XMLGenerator adapter', old_adapter),
+        ('XMLEncoderAdapter', new_adapter),
+        ('XMLEncoderAdapter (indent=False)', unindented_adapter),
+    ]
+    old_time = None
+
+    for name, adapter in results:
+        elapsed = min(timeit.repeat(lambda: adapter.encode(payload),
+                                    number=runs, repeat=3)) / runs
+
+        if old_time is None:
+            old_time = elapsed
+
+        print('%-34s %8.2f ms  (%.1fx)' % (name, elapsed * 1000,
+                                           old_time / elapsed))
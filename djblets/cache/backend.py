@@ -1,13 +1,25 @@
 from __future__ import unicode_literals
-from hashlib import md5
+from collections import OrderedDict
+from hashlib import md5, sha1
 import logging
+import threading
+import time
+import uuid
 import zlib
 
 from django.conf import settings
-from django.core.cache import cache
+from django.core.cache import cache as default_cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
 from django.contrib.sites.models import Site
+from django.db import DatabaseError
+from django.db.models.signals import post_delete, post_save
 
+from djblets.cache.codecs import (get_large_data_codec, LargeDataCodec,
+                                  NullCodec, ZlibCodec)
 from djblets.cache.errors import MissingChunkError
+from djblets.cache.metrics import record_metric
+from djblets.util.compat import six
 from djblets.util.compat.six.moves import (cPickle as pickle,
                                            cStringIO as StringIO)
 
@@ -19,28 +31,588 @@ CACHE_CHUNK_SIZE = 2**20 - 1024 # almost 1M (memcached's slab limit)
 # large data handling)
 MAX_KEY_SIZE = 240
 
+# Values that pickle to more than this many bytes are stored as large data,
+# since they won't fit in a single memcached slab.
+MAX_CACHE_VALUE_SIZE = getattr(settings, 'CACHE_MAX_VALUE_SIZE',
+                               CACHE_CHUNK_SIZE)
 
-def _cache_fetch_large_data(cache, key, compress_large_data):
-    chunk_count = cache.get(make_cache_key(key))
+# The maximum number of cache keys to remember, avoiding the need to
+# recompute them.
+MAX_MEMOIZED_CACHE_KEYS = 10000
+
+# Locking constraints used to prevent multiple processes from computing the
+# same data at once.
+DEFAULT_LOCK_TIMEOUT = 30
+DEFAULT_LOCK_WAIT_TIME = 5
+LOCK_POLL_INTERVAL = 0.1
+
+# Defaults for the per-process local cache used in front of the main cache.
+DEFAULT_LOCAL_CACHE_MAX_ENTRIES = 1000
+DEFAULT_LOCAL_CACHE_EXPIRATION_TIME = 60
+LOCAL_CACHE_SYNC_INTERVAL = 5
+
+# Defaults for falling back on a local memory cache when the cache backend
+# keeps failing.
+DEFAULT_CACHE_FAILURE_THRESHOLD = 5
+DEFAULT_CACHE_FAILURE_COOLDOWN = 30
+DEFAULT_FALLBACK_CACHE_MAX_ENTRIES = 1000
+DEFAULT_MAX_PENDING_INVALIDATIONS = 10000
+
+# Chunks shared between large data entries are stored again if they'd
+# expire sooner than a new entry using them, by more than this fraction of
+# the new entry's expiration time.
+SHARED_CHUNK_EXPIRATION_SLACK = 0.1
+
+# Memoized data is stored in its pickled form, after this prefix. The cache
+# backend then stores the string as-is, rather than pickling the data again.
+_PICKLED_DATA_PREFIX = b'djblets-pickled:'
+
+# Pickled data is stored under its own key, built from this format. Older
+# versions stored the data itself under the memoized key, and would return
+# the pickled form as the data if they shared a key with newer versions.
+_PICKLED_DATA_KEY_FORMAT = '%s:pickled'
+
+# Returned when looking up data that isn't in the cache.
+_NO_RESULT = object()
+
+# The site-specific prefix for cache keys, and a mapping of keys passed to
+# make_cache_key to the resulting cache keys.
+_cache_key_prefix = None
+_cache_keys = {}
+
+
+class CircuitBreakerCache(object):
+    """Wraps a cache backend, falling back on local memory when it fails.
+
+    When the cache backend raises errors failure_threshold times in a row,
+    the circuit breaker trips. For the next cooldown seconds, all cache
+    operations go to a bounded local memory cache in this process instead,
+    rather than waiting on a backend that's likely down. After that, the
+    backend is tried again. If it fails again, the circuit breaker trips
+    right away.
+
+    Operations that fail while the backend is still being tried fall back on
+    the local memory cache as well.
+
+    Keys that are set, deleted or incremented in local memory (such as
+    namespace generations bumped by invalidate_namespace()) are deleted from
+    the backend once it recovers, so that it doesn't serve data that was
+    invalidated in the meantime. Up to max_pending_invalidations keys are
+    tracked. Past that, an error is logged, and stale data may be served
+    until it expires.
+
+    Failures are only noticed when the backend raises an exception. This
+    works with backends such as pylibmc (PyLibMCCache) and the database and
+    file-based caches. Django's MemcachedCache (python-memcached) doesn't
+    raise when a server is down. It returns None from get() and ignores
+    set(), so the circuit breaker never trips with it.
+
+    get_state() returns the current state, for use in monitoring.
+    """
+    # Errors caused by the data or arguments, rather than the backend.
+    NON_BACKEND_ERRORS = (pickle.PicklingError, TypeError, ValueError)
+
+    # Operations that modify a single key, or a list or dictionary of keys.
+    KEY_OPERATIONS = ('add', 'set', 'delete', 'incr', 'decr')
+    MULTI_KEY_OPERATIONS = ('set_many', 'delete_many')
+
+    def __init__(self, cache,
+                 failure_threshold=DEFAULT_CACHE_FAILURE_THRESHOLD,
+                 cooldown=DEFAULT_CACHE_FAILURE_COOLDOWN,
+                 fallback_max_entries=DEFAULT_FALLBACK_CACHE_MAX_ENTRIES,
+                 max_pending_invalidations=DEFAULT_MAX_PENDING_INVALIDATIONS):
+        self.cache = cache
+        self.fallback_cache = LocMemCache('djblets-cache-fallback', {
+            'OPTIONS': {
+                'MAX_ENTRIES': fallback_max_entries,
+            },
+        })
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_pending_invalidations = max_pending_invalidations
+
+        self.failures = 0
+        self.trip_count = 0
+        self.tripped_time = None
+        self.lost_invalidations = False
+        self._pending_invalidations = set()
+        self._pending_clear = False
+        self._lock = threading.Lock()
+
+    def is_tripped(self):
+        """Returns whether operations are currently going to local memory."""
+        tripped_time = self.tripped_time
+
+        return (tripped_time is not None and
+                time.time() < tripped_time + self.cooldown)
+
+    def get_state(self):
+        """Returns the state of the circuit breaker."""
+        if self.is_tripped():
+            state = 'tripped'
+        elif self.failures >= self.failure_threshold:
+            state = 'retrying'
+        else:
+            state = 'ok'
+
+        return {
+            'state': state,
+            'failures': self.failures,
+            'trip_count': self.trip_count,
+            'tripped_time': self.tripped_time,
+            'pending_invalidations': len(self._pending_invalidations),
+            'lost_invalidations': self.lost_invalidations,
+        }
+
+    def add(self, *args, **kwargs):
+        return self._call('add', *args, **kwargs)
+
+    def get(self, *args, **kwargs):
+        return self._call('get', *args, **kwargs)
+
+    def set(self, *args, **kwargs):
+        return self._call('set', *args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        return self._call('delete', *args, **kwargs)
+
+    def get_many(self, *args, **kwargs):
+        return self._call('get_many', *args, **kwargs)
+
+    def set_many(self, *args, **kwargs):
+        return self._call('set_many', *args, **kwargs)
+
+    def delete_many(self, *args, **kwargs):
+        return self._call('delete_many', *args, **kwargs)
+
+    def has_key(self, *args, **kwargs):
+        return self._call('has_key', *args, **kwargs)
+
+    def incr(self, *args, **kwargs):
+        return self._call('incr', *args, **kwargs)
+
+    def decr(self, *args, **kwargs):
+        return self._call('decr', *args, **kwargs)
+
+    def clear(self):
+        self.fallback_cache.clear()
+
+        return self._call('clear')
+
+    def __contains__(self, key):
+        return self.has_key(key)
+
+    def _call(self, name, *args, **kwargs):
+        if self.is_tripped():
+            self._record_invalidation(name, args)
+
+            return getattr(self.fallback_cache, name)(*args, **kwargs)
+
+        try:
+            result = getattr(self.cache, name)(*args, **kwargs)
+        except self.NON_BACKEND_ERRORS:
+            raise
+        except Exception as e:
+            self._record_failure(e)
+            self._record_invalidation(name, args)
+
+            return getattr(self.fallback_cache, name)(*args, **kwargs)
+
+        if self.failures or self._pending_invalidations or self._pending_clear:
+            self._record_success()
+
+        return result
+
+    def _record_invalidation(self, name, args):
+        """Records keys modified in local memory instead of the backend."""
+        if name == 'clear':
+            self._pending_clear = True
+            return
+        elif name in self.KEY_OPERATIONS:
+            keys = args[:1]
+        elif name in self.MULTI_KEY_OPERATIONS:
+            keys = list(args[0])
+        else:
+            return
+
+        with self._lock:
+            if (len(self._pending_invalidations) + len(keys) <=
+                self.max_pending_invalidations):
+                self._pending_invalidations.update(keys)
+            elif not self.lost_invalidations:
+                logging.error('Too many cache keys were modified while the '
+                              'cache backend was unavailable. Stale data '
+                              'may be served from it until it expires.')
+                self.lost_invalidations = True
+
+    def _record_failure(self, error):
+        with self._lock:
+            self.failures += 1
+
+            if self.failures < self.failure_threshold:
+                logging.warning('Cache backend error: %s' % error)
+            elif not self.is_tripped():
+                logging.error('Cache backend failed %d times in a row (%s). '
+                              'Using local memory for the next %d seconds.'
+                              % (self.failures, error, self.cooldown))
+
+                self.tripped_time = time.time()
+                self.trip_count += 1
+
+    def _record_success(self):
+        with self._lock:
+            if self.failures >= self.failure_threshold:
+                logging.info('Cache backend has recovered.')
+
+                # Anything stored locally may be out of date by the next
+                # time the backend fails.
+                self.fallback_cache.clear()
+
+            self.failures = 0
+            self.tripped_time = None
+
+            pending_clear = self._pending_clear
+            pending_invalidations = self._pending_invalidations
+            self._pending_clear = False
+            self._pending_invalidations = set()
+
+        # Anything modified in local memory is removed from the backend, so
+        # that it doesn't serve data that was invalidated or replaced.
+        try:
+            if pending_clear:
+                self.cache.clear()
+            elif pending_invalidations:
+                self.cache.delete_many(list(pending_invalidations))
+        except Exception as e:
+            logging.warning('Failed to apply cache invalidations made while '
+                            'the cache backend was unavailable: %s' % e)
+
+            with self._lock:
+                self._pending_clear = self._pending_clear or pending_clear
+                self._pending_invalidations.update(pending_invalidations)
+
+
+cache = CircuitBreakerCache(
+    default_cache,
+    failure_threshold=getattr(settings, 'CACHE_FAILURE_THRESHOLD',
+                              DEFAULT_CACHE_FAILURE_THRESHOLD),
+    cooldown=getattr(settings, 'CACHE_FAILURE_COOLDOWN',
+                     DEFAULT_CACHE_FAILURE_COOLDOWN))
+
+
+class LocalCache(object):
+    """A bounded, per-process cache kept in front of the main cache.
+
+    This holds onto frequently accessed data in memory, so that it doesn't
+    have to be fetched from the main cache on every access. Entries are
+    evicted in least recently used order once max_entries is reached, and
+    expire after a short amount of time.
+
+    The caches in all processes are kept coherent through a generation
+    number stored in the main cache. Calling invalidate() bumps the
+    generation, causing every process to clear its local cache the next
+    time it checks (at most every LOCAL_CACHE_SYNC_INTERVAL seconds).
+
+    Data returned from the local cache is shared, and must not be modified
+    by the caller.
+    """
+    GENERATION_KEY = 'djblets-local-cache-gen'
+
+    def __init__(self, max_entries=DEFAULT_LOCAL_CACHE_MAX_ENTRIES,
+                 expiration=DEFAULT_LOCAL_CACHE_EXPIRATION_TIME,
+                 sync_interval=LOCAL_CACHE_SYNC_INTERVAL):
+        self.max_entries = max_entries
+        self.expiration = expiration
+        self.sync_interval = sync_interval
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._last_sync_gen = None
+        self._next_sync_time = 0
+
+    def get(self, key, default=None):
+        """Returns the data for a key, or default if it isn't cached."""
+        self._sync()
+
+        with self._lock:
+            try:
+                data, expires = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+
+            if expires <= time.time():
+                self.misses += 1
+                return default
+
+            # Re-insert the entry to mark it as the most recently used.
+            self._entries[key] = (data, expires)
+            self.hits += 1
+
+            return data
+
+    def set(self, key, data, expiration=None):
+        """Stores data for a key, evicting old entries if needed."""
+        if expiration is None:
+            expiration = self.expiration
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (data, time.time() + expiration)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Removes the data for a key from this process's cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all data from this process's cache."""
+        with self._lock:
+            self._entries.clear()
+
+    def invalidate(self):
+        """Invalidates the local caches in all processes."""
+        sync_key = make_cache_key(self.GENERATION_KEY)
+
+        try:
+            cache.incr(sync_key)
+        except ValueError:
+            cache.add(sync_key, 1, DEFAULT_EXPIRATION_TIME)
+
+        self.clear()
+        self._next_sync_time = 0
+
+    def get_stats(self):
+        """Returns statistics on the usage of this process's cache."""
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
+
+    def _sync(self):
+        """Clears the cache if it's been invalidated by any process."""
+        now = time.time()
+
+        if now < self._next_sync_time:
+            return
+
+        self._next_sync_time = now + self.sync_interval
+        sync_gen = cache.get(make_cache_key(self.GENERATION_KEY))
+
+        if sync_gen != self._last_sync_gen:
+            self._last_sync_gen = sync_gen
+            self.clear()
+
+
+local_cache = LocalCache(
+    max_entries=getattr(settings, 'CACHE_LOCAL_MAX_ENTRIES',
+                        DEFAULT_LOCAL_CACHE_MAX_ENTRIES),
+    expiration=getattr(settings, 'CACHE_LOCAL_EXPIRATION_TIME',
+                       DEFAULT_LOCAL_CACHE_EXPIRATION_TIME))
+
+
+def _compute_checksum(chunks):
+    """Returns a checksum used to validate the data of large cache entries.
+
+    The checksum is computed across a list of chunks, without joining them.
+    """
+    checksum = 1
+
+    for chunk in chunks:
+        checksum = zlib.adler32(chunk, checksum)
+
+    return checksum & 0xffffffff
+
+
+def _pop_chunks(chunks):
+    """Yields each chunk in a list, removing it from the list.
+
+    This allows each chunk to be freed as soon as it's been consumed.
+    """
+    chunks.reverse()
+
+    while chunks:
+        yield chunks.pop()
+
+
+def _decompress_to_buffer(chunks, data_length=None):
+    """Returns a file-like object holding the data from a stream of chunks.
+
+    If the length of the data is known, it's written into a buffer of that
+    size, which cStringIO then reads from without copying it. Otherwise, the
+    data is written to a cStringIO output buffer, which is slower to read
+    from, but still avoids joining the chunks.
+    """
+    if data_length is None:
+        file = StringIO()
+
+        for chunk in chunks:
+            file.write(chunk)
+
+        file.seek(0)
+
+        return file
+
+    buf = bytearray(data_length)
+    view = memoryview(buf)
+    pos = 0
+
+    for chunk in chunks:
+        if pos + len(chunk) > data_length:
+            raise MissingChunkError
+
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+
+    if pos != data_length:
+        raise MissingChunkError
+
+    del view
+
+    return StringIO(buf)
+
+
+def _get_codec(large_data_codec, compress_large_data):
+    """Returns the codec used to compress large data.
+
+    large_data_codec may be a codec ID or a LargeDataCodec instance. If not
+    provided, zlib is used, or no compression if compress_large_data is
+    False.
+    """
+    if large_data_codec is None:
+        if compress_large_data:
+            large_data_codec = ZlibCodec.codec_id
+        else:
+            large_data_codec = NullCodec.codec_id
+
+    if isinstance(large_data_codec, LargeDataCodec):
+        return large_data_codec
+
+    codec = get_large_data_codec(large_data_codec)
+
+    if codec is None:
+        raise ValueError('Unknown large data codec "%s".' % large_data_codec)
+
+    return codec
+
+
+def _get_chunk_key(chunk_hash):
+    """Returns the cache key for a chunk of large data."""
+    return make_cache_key('chunk-%s' % chunk_hash)
+
+
+def _get_chunk_marker_key(chunk_hash):
+    """Returns the cache key marking that a chunk has been stored."""
+    return make_cache_key('chunk-%s:stored' % chunk_hash)
+
+
+def _cache_fetch_chunks(cache, chunk_keys, generation=None):
+    """Returns the data held in the chunks with the given keys.
+
+    If any chunk is missing, or was stored with a different generation than
+    the one provided, MissingChunkError is raised.
+    """
+    results = cache.get_many(chunk_keys)
     data = []
 
-    chunk_keys = [make_cache_key('%s-%d' % (key, i))
-                  for i in range(int(chunk_count))]
-    chunks = cache.get_many(chunk_keys)
     for chunk_key in chunk_keys:
         try:
-            data.append(chunks[chunk_key][0])
+            chunk = results[chunk_key]
         except KeyError:
             logging.debug('Cache miss for key %s.' % chunk_key)
             raise MissingChunkError
 
-    data = b''.join(data)
+        if generation is not None and chunk[1:] != [generation]:
+            # This chunk was left over from a different store of this key.
+            logging.debug('Stale chunk found for key %s.' % chunk_key)
+            raise MissingChunkError
+
+        data.append(chunk[0])
+
+    return data
+
+
+def _cache_fetch_large_data(cache, key, codec):
+    manifest_key = make_cache_key(key)
+    manifest = cache.get(manifest_key)
+
+    if manifest is None:
+        logging.debug('Cache miss for key %s.' % manifest_key)
+        raise MissingChunkError
+
+    if isinstance(manifest, dict) and 'data' in manifest:
+        # Data that fits in a single chunk is kept in the manifest.
+        data = [manifest['data']]
+    elif isinstance(manifest, dict) and 'chunks' in manifest:
+        # The chunks are shared with other data, and stored under the hash
+        # of their contents.
+        try:
+            data = _cache_fetch_chunks(
+                cache,
+                [_get_chunk_key(chunk_hash)
+                 for chunk_hash in manifest['chunks']])
+        except MissingChunkError:
+            # Forget that these chunks were stored, so that the missing
+            # ones are stored again along with the recomputed data.
+            cache.delete_many([_get_chunk_marker_key(chunk_hash)
+                               for chunk_hash in manifest['chunks']])
+            raise
+    else:
+        # The chunks are stored under keys numbered after the data's key.
+        if isinstance(manifest, dict):
+            chunk_count = manifest['chunk_count']
+            generation = manifest['generation']
+        else:
+            # This is an older entry, which only stores the chunk count.
+            chunk_count = int(manifest)
+            generation = None
+            manifest = None
+
+        data = _cache_fetch_chunks(
+            cache,
+            [make_cache_key('%s-%d' % (key, i)) for i in range(chunk_count)],
+            generation)
+
+    if manifest is not None:
+        if (sum(len(chunk) for chunk in data) != manifest['length'] or
+            _compute_checksum(data) != manifest['checksum']):
+            logging.warning('Checksum mismatch for cache key "%s".' % key)
+            raise MissingChunkError
+
+        # The manifest says which codec compressed the data. Older entries
+        # without one were compressed according to compress_large_data.
+        codec_id = manifest.get('codec', codec.codec_id)
+
+        if codec_id != codec.codec_id:
+            codec = get_large_data_codec(codec_id)
 
-    if compress_large_data:
-        data = zlib.decompress(data)
+            if codec is None:
+                logging.warning('Unknown codec "%s" for cache key "%s".'
+                                % (codec_id, key))
+                raise MissingChunkError
+
+    # Each chunk is decompressed into a buffer and freed, so the compressed
+    # chunks are never joined into another copy of the data. The buffer is
+    # read through cStringIO, since cPickle calls back into Python for every
+    # read from any other file-like object.
+    file = _decompress_to_buffer(codec.decompress_iter(_pop_chunks(data)),
+                                 manifest and manifest.get('data_length'))
+
+    del data
 
     try:
-        unpickler = pickle.Unpickler(StringIO(data))
+        unpickler = pickle.Unpickler(file)
         data = unpickler.load()
     except Exception as e:
         logging.warning('Unpickle error for cache key "%s": %s.' % (key, e))
@@ -49,30 +621,321 @@ def _cache_fetch_large_data(cache, key, compress_large_data):
     return data
 
 
-def _cache_store_large_data(cache, key, data, expiration, compress_large_data):
+def _pickle_data(data):
+    """Returns the pickled form of data, as stored in the cache."""
+    return pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+
+
+def _get_data_key(key):
+    """Returns the cache key that memoized data is stored under."""
+    return make_cache_key(_PICKLED_DATA_KEY_FORMAT % key)
+
+
+def _load_cached_data(key, data):
+    """Returns memoized data as it was loaded from the cache.
+
+    Data stored in its pickled form is unpickled. If the data isn't in that
+    form, or can't be unpickled, _NO_RESULT is returned.
+    """
+    if (not isinstance(data, bytes) or
+        not data.startswith(_PICKLED_DATA_PREFIX)):
+        return _NO_RESULT
+
+    file = StringIO(data)
+    file.seek(len(_PICKLED_DATA_PREFIX))
+
+    try:
+        return pickle.Unpickler(file).load()
+    except Exception as e:
+        logging.warning('Unpickle error for cache key "%s": %s.' % (key, e))
+
+        return _NO_RESULT
+
+
+def _cache_store_large_data(cache, key, data, expiration, codec,
+                            pickled_data=None, share_chunks=False):
     # We store large data in the cache broken into chunks that are 1M in size.
-    # To do this easily, we first pickle the data and compress it with zlib.
-    # This gives us a string which can be chunked easily. These are then stored
-    # individually in the cache as single-element lists (so the cache backend
-    # doesn't try to convert binary data to utf8). The number of chunks needed
-    # is stored in the cache under the unadorned key
-    file = StringIO()
-    pickler = pickle.Pickler(file)
-    pickler.dump(data)
-    data = file.getvalue()
-
-    if compress_large_data:
-        data = zlib.compress(data)
-
-    i = 0
-    while len(data) > CACHE_CHUNK_SIZE:
-        chunk = data[0:CACHE_CHUNK_SIZE]
-        data = data[CACHE_CHUNK_SIZE:]
-        cache.set(make_cache_key('%s-%d' % (key, i)), [chunk], expiration)
-        i += 1
-    cache.set(make_cache_key('%s-%d' % (key, i)), [data], expiration)
-
-    cache.set(make_cache_key(key), '%d' % (i + 1), expiration)
+    # To do this easily, we first pickle the data and compress it with the
+    # codec (zlib, by default). This gives us a string which can be chunked
+    # easily. A manifest describing the chunks is stored under the unadorned
+    # key.
+    #
+    # The data may already have been pickled by the caller, in which case
+    # pickled_data is used as-is.
+    if pickled_data is None:
+        file = StringIO()
+        pickler = pickle.Pickler(file)
+        pickler.dump(data)
+        pickled_data = file.getvalue()
+
+    data_length = len(pickled_data)
+    data = codec.compress(pickled_data)
+    del pickled_data
+
+    # Chunks are sliced out at fixed offsets, rather than repeatedly
+    # reslicing the remainder of the data, which would copy most of the
+    # data again for every chunk.
+    chunks = [data[offset:offset + CACHE_CHUNK_SIZE]
+              for offset in range(0, len(data), CACHE_CHUNK_SIZE)]
+    manifest = {
+        'chunk_count': len(chunks),
+        'length': len(data),
+        'checksum': _compute_checksum([data]),
+        'codec': codec.codec_id,
+        'data_length': data_length,
+    }
+
+    if len(chunks) <= 1:
+        # Data that fits in a single chunk is kept in the manifest, so it
+        # can be fetched in one round trip.
+        manifest['data'] = data
+    elif share_chunks:
+        manifest['chunks'] = _cache_store_shared_chunks(cache, key, chunks,
+                                                        expiration)
+    else:
+        # The chunks are stored as lists of the chunk and a generation token
+        # (so the cache backend doesn't try to convert binary data to utf8),
+        # all in a single round trip. The manifest is stored only once the
+        # chunks are in place, so that readers never see a partially stored
+        # value.
+        generation = uuid.uuid4().hex
+        manifest['generation'] = generation
+        cache.set_many(
+            dict((make_cache_key('%s-%d' % (key, i)), [chunk, generation])
+                 for i, chunk in enumerate(chunks)),
+            expiration)
+
+    record_metric(key, 'stored_bytes', len(data))
+    record_metric(key, 'chunk_count', len(chunks))
+
+    cache.set(make_cache_key(key), manifest, expiration)
+
+
+def _cache_store_shared_chunks(cache, key, chunks, expiration):
+    """Stores chunks of large data under the hash of their contents.
+
+    Chunks that haven't changed since a previous version of this (or any
+    other) data are shared, rather than being stored again. This only helps
+    when the stored data is mostly unchanged up to the changed part, such as
+    uncompressed data that's appended to. Any change to compressed data
+    usually changes every chunk after it.
+
+    A small marker is stored along with each chunk, holding the time the
+    chunk expires, so that we can tell which are stored without fetching
+    them. Chunks that would expire well before the new data are stored
+    again, so that they last as long as it does. Fetching the data removes
+    the markers if any chunks have since been evicted.
+
+    Returns the list of chunk hashes for the manifest.
+    """
+    chunk_hashes = [sha1(chunk).hexdigest() for chunk in chunks]
+    marker_keys = [_get_chunk_marker_key(chunk_hash)
+                   for chunk_hash in chunk_hashes]
+    stored_markers = cache.get_many(marker_keys)
+
+    expires = time.time() + expiration
+    min_expires = expires - expiration * SHARED_CHUNK_EXPIRATION_SLACK
+    new_items = {}
+
+    for chunk, chunk_hash, marker_key in zip(chunks, chunk_hashes,
+                                             marker_keys):
+        if stored_markers.get(marker_key, 0) < min_expires:
+            # The chunks and markers are stored together, before the
+            # manifest, so that readers never see a partially stored value.
+            new_items[_get_chunk_key(chunk_hash)] = [chunk]
+            new_items[marker_key] = expires
+
+    if new_items:
+        cache.set_many(new_items, expiration)
+
+    record_metric(key, 'reused_chunk_count',
+                  len(set(marker_keys)) - len(new_items) // 2)
+
+    return chunk_hashes
+
+
+class _SoftExpiringData(object):
+    """Memoized data stored along with a soft expiration time.
+
+    Once the soft expiration time has passed, the data is considered stale.
+    It can still be returned while a fresh copy is being computed.
+    """
+    def __init__(self, data, soft_expiration):
+        self.data = data
+        self.expires = time.time() + soft_expiration
+
+    def is_stale(self):
+        return time.time() >= self.expires
+
+
+class _PromotedLargeData(object):
+    """Marks data that was too big to be stored normally.
+
+    This is stored in place of the data, which is stored as large data
+    under a separate key.
+    """
+
+
+def _get_promoted_key(key):
+    """Returns the key that promoted large data is stored under."""
+    return '%s:large' % key
+
+
+def _unwrap_data(data):
+    """Returns the memoized data, without any soft expiration wrapper."""
+    if isinstance(data, _SoftExpiringData):
+        return data.data
+    else:
+        return data
+
+
+def _cache_fetch_data(cache, key, large_data, codec):
+    """Fetches memoized data from the cache.
+
+    If the data isn't in the cache, _NO_RESULT is returned.
+    """
+    if not large_data:
+        data = cache.get(_get_data_key(key), _NO_RESULT)
+
+        if not isinstance(data, _PromotedLargeData):
+            return _load_cached_data(key, data)
+
+        key = _get_promoted_key(key)
+
+    try:
+        return _cache_fetch_large_data(cache, key, codec)
+    except MissingChunkError:
+        logging.debug('Cache miss for key %s.' % key)
+    except Exception as e:
+        logging.warning('Failed to fetch large data from cache for '
+                        'key %s: %s.' % (key, e))
+
+    return _NO_RESULT
+
+
+def _prepare_data_for_cache(cache, key, data, expiration, codec,
+                            share_chunks=False):
+    """Returns the data to store in the cache for a key.
+
+    This is the pickled form of the data. Data that's too big to be stored
+    normally is stored as large data, and a marker pointing to it is
+    returned in its place.
+    """
+    # Most people will be using memcached, and memcached has a limit of 1MB,
+    # past which it fails silently. The data is pickled here to find out how
+    # big it really is, which len() can't tell us for anything but strings.
+    # The pickled data is then stored, so it doesn't have to be pickled
+    # again by the cache backend.
+    start_time = time.time()
+    pickled_data = _pickle_data(data)
+    record_metric(key, 'serialize_time', time.time() - start_time)
+
+    value_size = len(_PICKLED_DATA_PREFIX) + len(pickled_data)
+    record_metric(key, 'value_size', value_size)
+
+    if value_size > MAX_CACHE_VALUE_SIZE:
+        logging.debug('Cache data for key "%s" (%d bytes) is too big for the '
+                      'cache. Storing it as large data.'
+                      % (key, value_size))
+        record_metric(key, 'promoted_large_data')
+
+        _cache_store_large_data(cache, _get_promoted_key(key), data,
+                                expiration, codec, pickled_data=pickled_data,
+                                share_chunks=share_chunks)
+
+        return _PromotedLargeData()
+
+    return _PICKLED_DATA_PREFIX + pickled_data
+
+
+def _cache_store_data(cache, key, data, expiration, soft_expiration,
+                      large_data, codec, share_chunks=False):
+    """Stores memoized data in the cache.
+
+    Data that's too big to be stored normally is stored as large data
+    instead, even if large_data is False.
+    """
+    if soft_expiration is not None:
+        data = _SoftExpiringData(data, soft_expiration)
+
+    if large_data:
+        _cache_store_large_data(cache, key, data, expiration, codec,
+                                share_chunks=share_chunks)
+        return
+
+    data = _prepare_data_for_cache(cache, key, data, expiration, codec,
+                                   share_chunks)
+
+    try:
+        cache.set(_get_data_key(key), data, expiration)
+    except Exception as e:
+        logging.warning('Failed to store data in the cache for key %s: '
+                        '%s' % (key, e))
+
+
+def _cache_compute_data(cache, key, lookup_callable, expiration,
+                        soft_expiration, large_data, codec,
+                        lock_key=None, share_chunks=False):
+    """Computes and stores memoized data.
+
+    If lock_key is provided, the lock will be released once the data is
+    stored, or if computing the data fails.
+    """
+    try:
+        start_time = time.time()
+        data = lookup_callable()
+        record_metric(key, 'compute_time', time.time() - start_time)
+
+        _cache_store_data(cache, key, data, expiration, soft_expiration,
+                          large_data, codec, share_chunks)
+    finally:
+        if lock_key is not None:
+            cache.delete(lock_key)
+
+    return data
+
+
+def _cache_refresh_data_in_background(*args, **kwargs):
+    """Computes and stores memoized data in a background thread."""
+    def _refresh():
+        try:
+            _cache_compute_data(*args, **kwargs)
+        except Exception as e:
+            logging.error('Failed to refresh stale data for cache key %s: %s'
+                          % (args[1], e), exc_info=1)
+
+    thread = threading.Thread(target=_refresh)
+    thread.daemon = True
+    thread.start()
+
+
+def _cache_wait_for_data(cache, key, lock_key, lock_wait_time, large_data,
+                         codec):
+    """Waits for another process to finish memoizing data.
+
+    This polls the cache until the data appears, the lock is released, or
+    lock_wait_time seconds have passed. If the data doesn't appear in time,
+    _NO_RESULT is returned.
+    """
+    deadline = time.time() + lock_wait_time
+
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+
+        # The lock is checked before the data, since the data is always
+        # stored before the lock is released.
+        lock_held = lock_key in cache
+        data = _cache_fetch_data(cache, key, large_data, codec)
+
+        if data is not _NO_RESULT:
+            return data
+
+        if not lock_held:
+            # The lock was released (or expired) without any data being
+            # stored, so the process holding it has likely failed.
+            break
+
+    return _NO_RESULT
 
 
 def cache_memoize(key, lookup_callable,
@@ -80,9 +943,25 @@ def cache_memoize(key, lookup_callable,
                                      DEFAULT_EXPIRATION_TIME),
                   force_overwrite=False,
                   large_data=False,
-                  compress_large_data=True):
+                  compress_large_data=True,
+                  large_data_codec=None,
+                  use_lock=False,
+                  lock_timeout=DEFAULT_LOCK_TIMEOUT,
+                  lock_wait_time=DEFAULT_LOCK_WAIT_TIME,
+                  soft_expiration=None,
+                  background_refresh=False,
+                  use_local_cache=False,
+                  namespaces=None,
+                  share_large_data_chunks=False):
     """Memoize the results of a callable inside the configured cache.
 
+    Hits, misses, timings and sizes are recorded with any metrics sinks
+    registered in djblets.cache.metrics.
+
+    Data is stored in its pickled form, under a key derived from
+    make_cache_key(key) rather than that key itself, so it shouldn't be
+    read or deleted directly. Use namespaces to invalidate it.
+
     Keyword arguments:
     expiration          -- The expiration time for the key.
     force_overwrite     -- If True, the value will always be computed and stored
@@ -92,82 +971,460 @@ def cache_memoize(key, lookup_callable,
                            This is useful for very large, computationally
                            intensive hunks of data which we don't want to store
                            in a database due to the way things are accessed.
+                           Data too big to be stored normally (more than
+                           settings.CACHE_MAX_VALUE_SIZE bytes pickled) is
+                           stored this way automatically.
     compress_large_data -- Compresses the data with zlib compression when
                            large_data is True.
+    large_data_codec    -- The codec used to compress the data when
+                           large_data is True. This may be the ID of a
+                           registered codec or a LargeDataCodec instance.
+                           It overrides compress_large_data.
+    use_lock            -- If True, only one process at a time will compute
+                           the data on a cache miss. Other processes will wait
+                           up to lock_wait_time seconds for the data to be
+                           stored before computing it themselves.
+    lock_timeout        -- The expiration time for the lock. This allows
+                           other processes to take over if the process holding
+                           the lock dies.
+    lock_wait_time      -- The maximum time to wait for another process to
+                           store the data when use_lock is True.
+    soft_expiration     -- If set, the data will be considered stale after
+                           this many seconds. Stale data is returned right
+                           away while one caller computes a fresh copy. This
+                           should be less than expiration.
+    background_refresh  -- If True, stale data will be refreshed in a
+                           background thread, rather than by the caller that
+                           found it to be stale.
+    use_local_cache     -- If True, the data will also be kept in this
+                           process's local cache, which is checked before
+                           the main cache. This is useful for small, hot
+                           pieces of data that rarely change. The data isn't
+                           kept locally for longer than expiration, and isn't
+                           kept locally at all if soft_expiration is set.
+    namespaces          -- A list of namespaces the data belongs to. All data
+                           in a namespace can be invalidated at once through
+                           invalidate_namespace(). This costs an additional
+                           cache lookup for the namespace generations. With
+                           use_local_cache, the generations are kept locally
+                           too, for up to LOCAL_CACHE_SYNC_INTERVAL seconds,
+                           so invalidations made by other processes can take
+                           that long to be seen.
+    share_large_data_chunks -- If True, chunks of large data are stored
+                           under the hash of their contents, and shared with
+                           any other large data containing the same chunks.
+                           This only saves storing chunks again for data
+                           that's uncompressed (compress_large_data=False)
+                           or otherwise unchanged up to the changed part,
+                           and costs an extra cache lookup when storing.
     """
-    if large_data:
-        if not force_overwrite and make_cache_key(key) in cache:
-            try:
-                data = _cache_fetch_large_data(cache, key, compress_large_data)
+    # Stale local data can't be refreshed, so data with a soft expiration
+    # isn't kept locally.
+    use_local_cache = use_local_cache and soft_expiration is None
+
+    if namespaces:
+        key += _get_namespace_suffix(namespaces, use_local_cache)
+
+    if use_local_cache:
+        if not force_overwrite:
+            data = local_cache.get(key, _NO_RESULT)
+
+            if data is not _NO_RESULT:
+                record_metric(key, 'local_hit')
                 return data
-            except Exception as e:
-                logging.warning('Failed to fetch large data from cache for '
-                                'key %s: %s.' % (key, e))
+
+    data = _cache_memoize(key, lookup_callable,
+                          expiration=expiration,
+                          force_overwrite=force_overwrite,
+                          large_data=large_data,
+                          compress_large_data=compress_large_data,
+                          large_data_codec=large_data_codec,
+                          use_lock=use_lock,
+                          lock_timeout=lock_timeout,
+                          lock_wait_time=lock_wait_time,
+                          soft_expiration=soft_expiration,
+                          background_refresh=background_refresh,
+                          share_chunks=share_large_data_chunks)
+
+    if use_local_cache:
+        local_cache.set(key, data, min(expiration, local_cache.expiration))
+
+    return data
+
+
+def _cache_memoize(key, lookup_callable, expiration, force_overwrite,
+                   large_data, compress_large_data, large_data_codec,
+                   use_lock, lock_timeout, lock_wait_time, soft_expiration,
+                   background_refresh, share_chunks):
+    """Memoizes data in the main cache.
+
+    This implements cache_memoize, without the local cache.
+    """
+    # The codec is needed even without large_data, in case the data turns
+    # out to be too big and is stored as large data anyway.
+    codec = _get_codec(large_data_codec, compress_large_data)
+
+    if not force_overwrite:
+        start_time = time.time()
+        data = _cache_fetch_data(cache, key, large_data, codec)
+        record_metric(key, 'fetch_time', time.time() - start_time)
+
+        if data is _NO_RESULT:
+            record_metric(key, 'miss')
         else:
-            logging.debug('Cache miss for key %s.' % key)
+            if isinstance(data, _SoftExpiringData):
+                if not data.is_stale():
+                    record_metric(key, 'hit')
+                    return data.data
+            elif soft_expiration is None:
+                record_metric(key, 'hit')
+                return data
 
-        data = lookup_callable()
-        _cache_store_large_data(cache, key, data, expiration,
-                                compress_large_data)
-        return data
+            # The data is stale. One caller refreshes it, and everyone else
+            # gets the stale data until then.
+            record_metric(key, 'stale_hit')
+            stale_data = _unwrap_data(data)
+            lock_key = make_cache_key('%s:lock' % key)
+
+            if not cache.add(lock_key, True, lock_timeout):
+                return stale_data
+
+            if background_refresh:
+                _cache_refresh_data_in_background(
+                    cache, key, lookup_callable, expiration, soft_expiration,
+                    large_data, codec, lock_key=lock_key,
+                    share_chunks=share_chunks)
+
+                return stale_data
+
+            return _cache_compute_data(cache, key, lookup_callable,
+                                       expiration, soft_expiration,
+                                       large_data, codec,
+                                       lock_key=lock_key,
+                                       share_chunks=share_chunks)
 
+    if use_lock and not force_overwrite:
+        lock_key = make_cache_key('%s:lock' % key)
+
+        if cache.add(lock_key, True, lock_timeout):
+            return _cache_compute_data(cache, key, lookup_callable,
+                                       expiration, soft_expiration,
+                                       large_data, codec,
+                                       lock_key=lock_key,
+                                       share_chunks=share_chunks)
+
+        start_time = time.time()
+        data = _cache_wait_for_data(cache, key, lock_key, lock_wait_time,
+                                    large_data, codec)
+        record_metric(key, 'lock_wait_time', time.time() - start_time)
+
+        if data is not _NO_RESULT:
+            return _unwrap_data(data)
+
+        record_metric(key, 'lock_timeout')
+        logging.warning('Timed out waiting for another process to store '
+                        'data for cache key %s. Computing it instead.'
+                        % key)
+
+    return _cache_compute_data(cache, key, lookup_callable, expiration,
+                               soft_expiration, large_data,
+                               codec, share_chunks=share_chunks)
+
+
+def cache_memoize_many(keys, lookup_callable,
+                       expiration=getattr(settings, 'CACHE_EXPIRATION_TIME',
+                                          DEFAULT_EXPIRATION_TIME),
+                       force_overwrite=False,
+                       batch_lookup=True,
+                       namespaces=None):
+    """Memoize the results of a callable for many keys at once.
+
+    All keys are looked up in the cache with a single request, and any
+    data that had to be computed is stored with a single request. Data is
+    stored under the same keys and in the same form as cache_memoize, so
+    data memoized with cache_memoize can be fetched here, and vice-versa.
+    Data too big to be stored normally is stored as large data, as with
+    cache_memoize.
+
+    Data memoized with cache_memoize using large_data=True can't be fetched
+    here, and is treated as missing from the cache.
+
+    Returns a dictionary mapping each key to its data.
+
+    Keyword arguments:
+    expiration          -- The expiration time for the keys.
+    force_overwrite     -- If True, the values will always be computed and
+                           stored regardless of whether they exist in the
+                           cache already.
+    batch_lookup        -- If True, lookup_callable will be called once with
+                           a list of all keys missing from the cache, and
+                           must return a dictionary mapping those keys to
+                           their data. If False, it will be called with each
+                           missing key, and must return the data for it.
+    namespaces          -- A list of namespaces the data belongs to. See
+                           cache_memoize.
+    """
+    cache_keys = {}
+
+    if namespaces:
+        namespace_suffix = _get_namespace_suffix(namespaces)
     else:
-        key = make_cache_key(key)
-        if not force_overwrite and key in cache:
-            return cache.get(key)
-        data = lookup_callable()
+        namespace_suffix = ''
+
+    for key in keys:
+        cache_keys[key] = _get_data_key(key + namespace_suffix)
+
+    results = {}
+
+    # Data too big to be stored normally is stored as large data, using the
+    # same codec as cache_memoize.
+    codec = _get_codec(None, True)
+
+    if not force_overwrite:
+        cached_data = cache.get_many(list(cache_keys.values()))
+
+        for key, cache_key in six.iteritems(cache_keys):
+            data = cached_data.get(cache_key, _NO_RESULT)
+
+            if isinstance(data, _PromotedLargeData):
+                data = _cache_fetch_data(
+                    cache, _get_promoted_key(key + namespace_suffix), True,
+                    codec)
+            else:
+                data = _load_cached_data(key, data)
+
+            if data is _NO_RESULT:
+                record_metric(key, 'miss')
+            else:
+                record_metric(key, 'hit')
+                results[key] = _unwrap_data(data)
+
+    missing_keys = [
+        key
+        for key in cache_keys
+        if key not in results
+    ]
 
-        # Most people will be using memcached, and memcached has a limit of 1MB.
-        # Data this big should be broken up somehow, so let's warn about this.
-        # Users should hopefully be using large_data=True in this case.
-        # XXX - since 'data' may be a sequence that's not a string/unicode,
-        #       this can fail. len(data) might be something like '6' but the
-        #       data could exceed a megabyte. The best way to catch this would
-        #       be an exception, but while python-memcached defines an exception
-        #       type for this, it never uses it, choosing instead to fail
-        #       silently. WTF.
-        if len(data) >= CACHE_CHUNK_SIZE:
-            logging.warning('Cache data for key "%s" (length %s) may be too '
-                            'big for the cache.' % (key, len(data)))
+    if missing_keys:
+        if batch_lookup:
+            start_time = time.time()
+            computed_data = lookup_callable(missing_keys)
+            compute_time = (time.time() - start_time) / len(missing_keys)
+
+            for key in missing_keys:
+                record_metric(key, 'compute_time', compute_time)
+        else:
+            computed_data = {}
+
+            for key in missing_keys:
+                start_time = time.time()
+                computed_data[key] = lookup_callable(key)
+                record_metric(key, 'compute_time', time.time() - start_time)
+
+        results.update(computed_data)
 
         try:
-            cache.set(key, data, expiration)
-        except:
-            pass
-        return data
+            cache.set_many(
+                dict((_get_data_key(key + namespace_suffix),
+                      _prepare_data_for_cache(cache, key + namespace_suffix,
+                                              data, expiration, codec))
+                     for key, data in six.iteritems(computed_data)),
+                expiration)
+        except Exception as e:
+            logging.warning('Failed to store data in the cache for keys %s: '
+                            '%s' % (', '.join(missing_keys), e))
+
+    return results
+
+
+def _create_namespace_generation():
+    """Returns a new generation number for a namespace.
+
+    This is based on the current time, so that a namespace whose generation
+    fell out of the cache never reuses a generation it had before.
+    """
+    return int(time.time() * 1000)
+
+
+def get_namespace_generations(namespaces):
+    """Returns the current generation number for each of the namespaces.
+
+    The generations are returned as a dictionary keyed by namespace. Any
+    namespace without a generation in the cache is given a new one.
+    """
+    generation_keys = {}
+
+    for namespace in namespaces:
+        generation_keys[namespace] = _get_namespace_generation_key(namespace)
+
+    cached_generations = cache.get_many(list(generation_keys.values()))
+    generations = {}
+
+    for namespace, generation_key in six.iteritems(generation_keys):
+        try:
+            generation = cached_generations[generation_key]
+        except KeyError:
+            generation = _create_namespace_generation()
+
+            if not cache.add(generation_key, generation,
+                             DEFAULT_EXPIRATION_TIME):
+                # Another process created the generation first.
+                generation = cache.get(generation_key, generation)
+
+        generations[namespace] = generation
+
+    return generations
 
 
-def make_cache_key(key):
+def invalidate_namespace(namespace):
+    """Invalidates all data cached within a namespace.
+
+    This bumps the namespace's generation number. Keys built with the
+    namespace will no longer match the keys of any data cached before, which
+    will eventually expire from the cache.
+    """
+    generation_key = _get_namespace_generation_key(namespace)
+    local_cache.delete(generation_key)
+
+    try:
+        cache.incr(generation_key)
+    except ValueError:
+        # The generation isn't in the cache, so a new one will be created
+        # the next time it's needed.
+        pass
+
+
+def _get_namespace_generation_key(namespace):
+    """Returns the cache key for a namespace's generation number."""
+    return make_cache_key('namespace-gen:%s' % namespace)
+
+
+def _get_namespace_suffix(namespaces, use_local_cache=False):
+    """Returns a suffix for keys containing the namespace generations.
+
+    If use_local_cache is True, generations are looked up in the local
+    cache first, and kept there for up to the local cache's sync interval.
+    """
+    if use_local_cache:
+        generations = {}
+        missing_namespaces = []
+
+        for namespace in namespaces:
+            generation = local_cache.get(
+                _get_namespace_generation_key(namespace))
+
+            if generation is None:
+                missing_namespaces.append(namespace)
+            else:
+                generations[namespace] = generation
+
+        if missing_namespaces:
+            missing_generations = \
+                get_namespace_generations(missing_namespaces)
+
+            for namespace, generation in six.iteritems(missing_generations):
+                local_cache.set(_get_namespace_generation_key(namespace),
+                                generation, local_cache.sync_interval)
+
+            generations.update(missing_generations)
+    else:
+        generations = get_namespace_generations(namespaces)
+
+    return '[%s]' % ','.join(
+        '%s=%s' % (namespace, generations[namespace])
+        for namespace in sorted(generations))
+
+
+def _get_cache_key_prefix():
+    """Returns the prefix used for all cache keys.
+
+    The prefix is computed once, and then reused until the Site changes.
+    If the Site can't be looked up due to a database error, None is
+    returned, and the lookup will be tried again next time.
+    """
+    global _cache_key_prefix
+
+    if _cache_key_prefix is not None:
+        return _cache_key_prefix
+
+    prefix = ''
+
+    if 'django.contrib.sites' in settings.INSTALLED_APPS:
+        try:
+            site = Site.objects.get_current()
+        except (Site.DoesNotExist, ImproperlyConfigured) as e:
+            logging.warning('Unable to look up the current Site for cache '
+                            'keys. Keys will not be prefixed: %s' % e)
+            site = None
+        except DatabaseError as e:
+            logging.debug('Unable to look up the current Site for cache '
+                          'keys: %s' % e)
+            return None
+
+        if site:
+            # The install has a Site app, so prefix the domain to the key.
+            # If a SITE_ROOT is defined, also include that, to allow for
+            # multiple instances on the same host.
+            site_root = getattr(settings, 'SITE_ROOT', None)
+
+            if site_root:
+                prefix = '%s:%s:' % (site.domain, site_root)
+            else:
+                prefix = '%s:' % site.domain
+
+    _cache_key_prefix = prefix
+
+    return prefix
+
+
+def _clear_cache_key_prefix(**kwargs):
+    """Clears the cached key prefix and all memoized cache keys."""
+    global _cache_key_prefix
+
+    _cache_key_prefix = None
+    _cache_keys.clear()
+
+
+def make_cache_key(key, namespaces=None):
     """Creates a cache key guaranteed to avoid conflicts and size limits.
 
     The cache key will be prefixed by the site's domain, and will be
     changed to an MD5SUM if it's larger than the maximum key size.
-    """
-    try:
-        site = Site.objects.get_current()
 
-        # The install has a Site app, so prefix the domain to the key.
-        # If a SITE_ROOT is defined, also include that, to allow for multiple
-        # instances on the same host.
-        site_root = getattr(settings, 'SITE_ROOT', None)
+    If a list of namespaces is provided, the key will contain the current
+    generation of each namespace, so that all keys within a namespace can be
+    invalidated at once through invalidate_namespace().
+    """
+    if namespaces:
+        key += _get_namespace_suffix(namespaces)
 
-        if site_root:
-            key = '%s:%s:%s' % (site.domain, site_root, key)
-        else:
-            key = '%s:%s' % (site.domain, key)
-    except:
-        # The install doesn't have a Site app, so use the key as-is.
+    try:
+        return _cache_keys[key]
+    except KeyError:
         pass
 
+    prefix = _get_cache_key_prefix()
+    full_key = '%s%s' % (prefix or '', key)
+
     # Adhere to memcached key size limit
-    if len(key) > MAX_KEY_SIZE:
-        digest = md5(key.encode('utf-8')).hexdigest();
+    if len(full_key) > MAX_KEY_SIZE:
+        digest = md5(full_key.encode('utf-8')).hexdigest()
 
         # Replace the excess part of the key with a digest of the key
-        key = key[:MAX_KEY_SIZE - len(digest)] + digest
+        full_key = full_key[:MAX_KEY_SIZE - len(digest)] + digest
 
     # Make sure this is a non-unicode string, in order to prevent errors
     # with some backends.
-    key = key.encode('utf-8')
+    full_key = full_key.encode('utf-8')
+
+    if prefix is not None:
+        if len(_cache_keys) >= MAX_MEMOIZED_CACHE_KEYS:
+            _cache_keys.clear()
+
+        _cache_keys[key] = full_key
+
+    return full_key
+
 
-    return key
+post_save.connect(_clear_cache_key_prefix, sender=Site)
+post_delete.connect(_clear_cache_key_prefix, sender=Site)
@@ -0,0 +1,138 @@
+from __future__ import unicode_literals
+import zlib
+
+from django.conf import settings
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+class LargeDataCodec(object):
+    """Compresses and decompresses large data stored in the cache.
+
+    Each codec has a unique codec_id, which is stored along with the data
+    it compressed. This allows the data to be decompressed later without
+    the caller needing to know which codec was used.
+
+    Subclasses must implement compress() and decompress(), and can
+    implement decompress_iter() to support decompressing data incrementally.
+    """
+    codec_id = None
+
+    def compress(self, data):
+        """Returns a compressed version of the data."""
+        raise NotImplementedError
+
+    def decompress(self, data):
+        """Returns the original data from a compressed version."""
+        raise NotImplementedError
+
+    def decompress_iter(self, chunks):
+        """Yields the original data from an iterable of compressed chunks.
+
+        By default, this decompresses all the chunks at once.
+        """
+        yield self.decompress(b''.join(chunks))
+
+
+class NullCodec(LargeDataCodec):
+    """A codec that stores data without any compression."""
+    codec_id = 'none'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def decompress_iter(self, chunks):
+        return iter(chunks)
+
+
+class ZlibCodec(LargeDataCodec):
+    """A codec that compresses data using zlib.
+
+    The compression level can be lowered to trade memory for less CPU time
+    when storing data. It doesn't need to be known when decompressing.
+    """
+    codec_id = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+    def decompress_iter(self, chunks):
+        decompressor = zlib.decompressobj()
+
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+
+        yield decompressor.flush()
+
+
+class LZ4Codec(LargeDataCodec):
+    """A codec that compresses data using LZ4.
+
+    This is much faster than zlib, at the cost of a lower compression
+    ratio. It's only available if the lz4 module is installed.
+    """
+    codec_id = 'lz4'
+
+    def compress(self, data):
+        return lz4_frame.compress(data)
+
+    def decompress(self, data):
+        return lz4_frame.decompress(data)
+
+    def decompress_iter(self, chunks):
+        decompressor = lz4_frame.LZ4FrameDecompressor()
+
+        for chunk in chunks:
+            yield decompressor.decompress(chunk)
+
+
+_codecs = {}
+
+
+def register_large_data_codec(codec):
+    """Registers a codec for use with large data in the cache.
+
+    If a codec with the same codec_id is already registered, it will be
+    replaced.
+    """
+    if not codec.codec_id:
+        raise ValueError('The codec must have a codec_id.')
+
+    _codecs[codec.codec_id] = codec
+
+
+def unregister_large_data_codec(codec):
+    """Unregisters a previously registered codec."""
+    try:
+        del _codecs[codec.codec_id]
+    except KeyError:
+        raise ValueError('The codec "%s" is not registered.'
+                         % codec.codec_id)
+
+
+def get_large_data_codec(codec_id):
+    """Returns the registered codec with the given ID.
+
+    If the codec isn't registered, None will be returned.
+    """
+    return _codecs.get(codec_id)
+
+
+register_large_data_codec(NullCodec())
+register_large_data_codec(
+    ZlibCodec(level=getattr(settings, 'CACHE_LARGE_DATA_ZLIB_LEVEL', 6)))
+
+if lz4_frame is not None:
+    register_large_data_codec(LZ4Codec())
@@ -17,6 +17,19 @@ def media_serial(request):
     return {'MEDIA_SERIAL': getattr(settings, "MEDIA_SERIAL", "")}
 
 
+def media_file_serials(request):
+    """
+    Exposes a dictionary of serial numbers for each media file, which can
+    be appended to the file's URL. Unlike MEDIA_SERIAL, a file's serial only
+    changes when the file itself changes.
+
+    This returns the value of settings.MEDIA_FILE_SERIALS, which should be
+    set by djblets.cache.serials.generate_media_file_serials(). Serials can
+    be looked up in templates with the getitem filter.
+    """
+    return {'MEDIA_FILE_SERIALS': getattr(settings, "MEDIA_FILE_SERIALS", {})}
+
+
 def ajax_serial(request):
     """
     Exposes a serial number that can be appended to filenames involving
@@ -0,0 +1,60 @@
+from __future__ import unicode_literals
+
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.utils.translation import ugettext as _
+
+from djblets.cache.warmup import get_cache_warmers, warm_cache
+
+
+class Command(NoArgsCommand):
+    """Fills the cache for all registered cache warmers.
+
+    This is meant to be run after a deploy or a cache restart, before the
+    site receives traffic.
+    """
+    option_list = NoArgsCommand.option_list + (
+        make_option('--threads', action='store', dest='threads', type='int',
+                    default=4,
+                    help=_('The number of computations to run at once')),
+        make_option('--rate', action='store', dest='rate', type='float',
+                    default=None,
+                    help=_('The maximum number of computations to start '
+                           'per second')),
+        make_option('--force', action='store_true', dest='force',
+                    default=False,
+                    help=_('Recompute data that is already in the cache')),
+    )
+
+    def handle_noargs(self, **options):
+        if options['threads'] < 1:
+            raise CommandError(_('--threads must be at least 1'))
+
+        if options['rate'] is not None and options['rate'] <= 0:
+            raise CommandError(_('--rate must be greater than 0'))
+
+        warmers = get_cache_warmers()
+        results = warm_cache(warmers,
+                             num_threads=options['threads'],
+                             rate=options['rate'],
+                             force_overwrite=options['force'])
+        failed = 0
+
+        for warmer, error in results:
+            if error is not None:
+                failed += 1
+                self.stderr.write(_("Failed to warm '%(key)s': %(error)s") % {
+                    'key': warmer.key,
+                    'error': error,
+                })
+
+        self.stdout.write(_('Warmed %(succeeded)d of %(total)d cache '
+                            'entries') % {
+            'succeeded': len(results) - failed,
+            'total': len(results),
+        })
+
+        if failed:
+            raise CommandError(_('%d cache entries could not be warmed')
+                               % failed)
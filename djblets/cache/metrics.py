@@ -0,0 +1,164 @@
+from __future__ import unicode_literals
+import logging
+import re
+import threading
+
+from django.conf import settings
+
+from djblets.cache.signals import cache_metric_recorded
+
+
+# Upper bounds (in milliseconds) of the buckets used for timing histograms.
+TIMING_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+_NAMESPACE_RE = re.compile(r'[^-:]+')
+
+
+def get_key_namespace(key):
+    """Returns the namespace for a cache key.
+
+    This is the part of the key before the first '-' or ':', which is
+    how keys for related data are typically grouped (for example, "feed"
+    for "feed-http://example.com/rss").
+    """
+    m = _NAMESPACE_RE.match(key)
+
+    if m:
+        return m.group(0)
+    else:
+        return key
+
+
+class CacheMetricsSink(object):
+    """Receives metrics recorded for memoized data.
+
+    Metrics are recorded per key namespace (see get_key_namespace). Each
+    metric has a name and a value. Counters (such as "hit" and "miss") have
+    a value of 1. Timings (such as "fetch_time" and "compute_time") are in
+    seconds. Sizes ("stored_bytes") are in bytes.
+
+    Subclasses must implement record().
+    """
+    def record(self, namespace, name, value):
+        raise NotImplementedError
+
+
+class LoggingMetricsSink(CacheMetricsSink):
+    """Writes each recorded metric to the debug log."""
+    def record(self, namespace, name, value):
+        logging.debug('Cache metric for %s: %s = %s'
+                      % (namespace, name, value))
+
+
+class SignalMetricsSink(CacheMetricsSink):
+    """Emits the cache_metric_recorded signal for each recorded metric."""
+    def record(self, namespace, name, value):
+        cache_metric_recorded.send(sender=self.__class__,
+                                   namespace=namespace,
+                                   name=name,
+                                   value=value)
+
+
+class StatsMetricsSink(CacheMetricsSink):
+    """Keeps running statistics on each recorded metric in memory.
+
+    For each namespace and metric, this keeps the number of times it was
+    recorded and the total, minimum and maximum values. Timings also keep a
+    histogram of how many values fell into each of TIMING_BUCKETS.
+    """
+    def __init__(self):
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, namespace, name, value):
+        with self._lock:
+            namespace_stats = self._stats.setdefault(namespace, {})
+
+            try:
+                stats = namespace_stats[name]
+            except KeyError:
+                stats = {
+                    'count': 0,
+                    'total': 0,
+                    'min': value,
+                    'max': value,
+                }
+
+                if name.endswith('_time'):
+                    stats['histogram'] = [0] * (len(TIMING_BUCKETS) + 1)
+
+                namespace_stats[name] = stats
+
+            stats['count'] += 1
+            stats['total'] += value
+            stats['min'] = min(stats['min'], value)
+            stats['max'] = max(stats['max'], value)
+
+            if 'histogram' in stats:
+                ms = value * 1000
+                i = 0
+
+                while i < len(TIMING_BUCKETS) and ms > TIMING_BUCKETS[i]:
+                    i += 1
+
+                stats['histogram'][i] += 1
+
+    def get_stats(self):
+        """Returns a copy of the statistics, keyed by namespace and metric."""
+        with self._lock:
+            return dict(
+                (namespace, dict((name, dict(stats))
+                                 for name, stats in namespace_stats.items()))
+                for namespace, namespace_stats in self._stats.items()
+            )
+
+    def reset(self):
+        """Resets all statistics."""
+        with self._lock:
+            self._stats = {}
+
+
+_metrics_sinks = None
+
+
+def get_metrics_sinks():
+    """Returns the list of registered metrics sinks.
+
+    The initial list is loaded from the CACHE_METRICS_SINKS setting, which
+    contains the class paths of the sinks to instantiate.
+    """
+    global _metrics_sinks
+
+    if _metrics_sinks is None:
+        _metrics_sinks = []
+
+        for sink_path in getattr(settings, 'CACHE_METRICS_SINKS', []):
+            module_name, class_name = sink_path.rsplit('.', 1)
+            module = __import__(module_name, {}, {}, class_name)
+            _metrics_sinks.append(getattr(module, class_name)())
+
+    return _metrics_sinks
+
+
+def register_metrics_sink(sink):
+    """Registers a sink to receive cache metrics."""
+    get_metrics_sinks().append(sink)
+
+
+def unregister_metrics_sink(sink):
+    """Unregisters a previously registered metrics sink."""
+    try:
+        get_metrics_sinks().remove(sink)
+    except ValueError:
+        raise ValueError('This metrics sink is not registered.')
+
+
+def record_metric(key, name, value=1):
+    """Records a metric for a cache key with all registered sinks."""
+    sinks = get_metrics_sinks()
+
+    if sinks:
+        namespace = get_key_namespace(key)
+
+        for sink in sinks:
+            sink.record(namespace, name, value)
@@ -1,11 +1,167 @@
 from __future__ import unicode_literals
+from hashlib import md5
+from multiprocessing.pool import ThreadPool
+import json
 import logging
 import os
+import stat
 
 from django.conf import settings
 from django.utils import importlib
 
 
+FILE_HASH_BLOCK_SIZE = 64 * 1024
+FILE_SERIAL_LENGTH = 12
+
+
+def _load_json_file(path):
+    """Loads cached serial data from a JSON file.
+
+    If the path isn't set, or the file doesn't exist or can't be loaded, an
+    empty dictionary is returned.
+    """
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'r') as fp:
+                return json.load(fp)
+        except (IOError, ValueError) as e:
+            logging.warning('Unable to load serial data from %s: %s'
+                            % (path, e))
+
+    return {}
+
+
+def _save_json_file(path, data):
+    """Saves cached serial data to a JSON file, if a path is set."""
+    if not path:
+        return
+
+    # Write to a temporary file first, so that other processes never see a
+    # partially written file.
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+
+    try:
+        with open(tmp_path, 'w') as fp:
+            json.dump(data, fp)
+
+        os.rename(tmp_path, path)
+    except (IOError, OSError) as e:
+        logging.warning('Unable to save serial data to %s: %s' % (path, e))
+
+
+def _hash_file(path):
+    """Returns a short hash of a file's contents."""
+    file_hash = md5()
+
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(FILE_HASH_BLOCK_SIZE), b''):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()[:FILE_SERIAL_LENGTH]
+
+
+def _scan_serial_dir(path, index):
+    """Returns the serial index entry for a single directory.
+
+    If the directory's modification time matches the one in the index, the
+    existing entry is reused without listing the directory or looking at
+    any of its files. A directory's modification time changes whenever
+    files are added, removed or replaced in it, which is how static media
+    and templates are deployed. Files modified in place without being
+    replaced won't be noticed until the index is removed.
+
+    Returns None if the directory doesn't exist.
+    """
+    try:
+        dir_mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+
+    entry = index.get(path)
+
+    if entry and entry['mtime'] == dir_mtime:
+        return entry
+
+    serial = 0
+    subdirs = []
+
+    for name in os.listdir(path):
+        file_path = os.path.join(path, name)
+
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            # This is likely a broken symlink.
+            continue
+
+        if stat.S_ISDIR(st.st_mode):
+            # Like os.walk, don't follow symlinks to directories.
+            if not os.path.islink(file_path):
+                subdirs.append(name)
+        elif int(st.st_mtime) > serial:
+            serial = int(st.st_mtime)
+
+    return {
+        'mtime': dir_mtime,
+        'serial': serial,
+        'subdirs': subdirs,
+    }
+
+
+def _generate_tree_serial(serial_type, paths):
+    """Returns the latest modification time of all files under the paths.
+
+    The serial index (stored in SERIAL_INDEX_PATH, if set) is used to skip
+    directories that haven't changed since the last crawl. It contains an
+    entry for each directory crawled for each type of serial, with the
+    directory's modification time, the latest modification time of the
+    files in it, and its subdirectories.
+
+    If SERIAL_CRAWL_THREADS is set to more than 1, each level of the
+    directory trees is crawled in parallel.
+    """
+    index_path = getattr(settings, 'SERIAL_INDEX_PATH', None)
+    full_index = _load_json_file(index_path)
+    index = full_index.get(serial_type, {})
+    new_index = {}
+    num_threads = getattr(settings, 'SERIAL_CRAWL_THREADS', 1)
+    serial = 0
+    pending = list(paths)
+
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+        scan = pool.map
+    else:
+        pool = None
+        scan = map
+
+    try:
+        while pending:
+            entries = scan(lambda path: _scan_serial_dir(path, index),
+                           pending)
+            subdir_paths = []
+
+            for path, entry in zip(pending, entries):
+                if entry is None:
+                    continue
+
+                new_index[path] = entry
+                serial = max(serial, entry['serial'])
+                subdir_paths += [os.path.join(path, name)
+                                 for name in entry['subdirs']]
+
+            pending = subdir_paths
+    finally:
+        if pool:
+            pool.close()
+
+    if new_index != index:
+        full_index[serial_type] = new_index
+        _save_json_file(index_path, full_index)
+
+    return serial
+
+
 def generate_media_serial():
     """
     Generates a media serial number that can be appended to a media filename
@@ -21,18 +177,86 @@ def generate_media_serial():
 
     if not MEDIA_SERIAL:
         media_dirs = getattr(settings, "MEDIA_SERIAL_DIRS", ["."])
+        MEDIA_SERIAL = _generate_tree_serial('media', [
+            os.path.join(settings.STATIC_ROOT, media_dir)
+            for media_dir in media_dirs
+        ])
 
-        for media_dir in media_dirs:
-            media_path = os.path.join(settings.STATIC_ROOT, media_dir)
+        setattr(settings, "MEDIA_SERIAL", MEDIA_SERIAL)
 
-            for root, dirs, files in os.walk(media_path):
-                for name in files:
-                    mtime = int(os.stat(os.path.join(root, name)).st_mtime)
 
-                    if mtime > MEDIA_SERIAL:
-                        MEDIA_SERIAL = mtime
+def generate_media_file_serials():
+    """
+    Generates a serial number for each media file, based on its contents.
 
-        setattr(settings, "MEDIA_SERIAL", MEDIA_SERIAL)
+    This allows each media file to have its own URL that can be cached
+    forever, which only changes when that file changes. Unlike
+    MEDIA_SERIAL, changing one file won't change the URLs of all the others.
+
+    This will crawl the same media files as generate_media_serial, and set
+    settings.MEDIA_FILE_SERIALS to a dictionary mapping each file's path
+    (relative to STATIC_ROOT) to its serial.
+
+    The serials are stored in the manifest at MEDIA_SERIAL_MANIFEST_PATH
+    along with each file's size and modification time, so that only new or
+    changed files need to be read again.
+    """
+    if getattr(settings, "MEDIA_FILE_SERIALS", None) is not None:
+        return
+
+    manifest_path = getattr(settings, "MEDIA_SERIAL_MANIFEST_PATH", None)
+    manifest = _load_json_file(manifest_path)
+    new_manifest = {}
+    serials = {}
+
+    for media_dir in getattr(settings, "MEDIA_SERIAL_DIRS", ["."]):
+        media_path = os.path.join(settings.STATIC_ROOT, media_dir)
+
+        for root, dirs, files in os.walk(media_path):
+            for name in files:
+                path = os.path.join(root, name)
+                rel_path = os.path.relpath(path, settings.STATIC_ROOT)
+                rel_path = rel_path.replace(os.sep, '/')
+
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    # This is likely a broken symlink.
+                    continue
+
+                entry = manifest.get(rel_path)
+
+                if (not entry or
+                    entry['mtime'] != st.st_mtime or
+                    entry['size'] != st.st_size):
+                    entry = {
+                        'mtime': st.st_mtime,
+                        'size': st.st_size,
+                        'serial': _hash_file(path),
+                    }
+
+                new_manifest[rel_path] = entry
+                serials[rel_path] = entry['serial']
+
+    if new_manifest != manifest:
+        _save_json_file(manifest_path, new_manifest)
+
+    setattr(settings, "MEDIA_FILE_SERIALS", serials)
+
+
+def get_media_file_serial(path):
+    """Returns the serial number for a media file.
+
+    The path is relative to STATIC_ROOT. If there's no serial for the file
+    (for instance, if generate_media_file_serials wasn't called), this will
+    fall back on MEDIA_SERIAL.
+    """
+    serials = getattr(settings, "MEDIA_FILE_SERIALS", None) or {}
+
+    try:
+        return serials[path]
+    except KeyError:
+        return getattr(settings, "MEDIA_SERIAL", "")
 
 
 def generate_ajax_serial():
@@ -48,14 +272,7 @@ def generate_ajax_serial():
 
     if not AJAX_SERIAL:
         template_dirs = getattr(settings, "TEMPLATE_DIRS", ["."])
-
-        for template_path in template_dirs:
-            for root, dirs, files in os.walk(template_path):
-                for name in files:
-                    mtime = int(os.stat(os.path.join(root, name)).st_mtime)
-
-                    if mtime > AJAX_SERIAL:
-                        AJAX_SERIAL = mtime
+        AJAX_SERIAL = _generate_tree_serial('ajax', template_dirs)
 
         setattr(settings, "AJAX_SERIAL", AJAX_SERIAL)
 
@@ -95,8 +312,14 @@ def generate_cache_serials():
     Wrapper around generate_media_serial and generate_ajax_serial to
     generate all serial numbers in one go.
 
+    If MEDIA_SERIAL_MANIFEST_PATH is set, this will also generate
+    per-file serials through generate_media_file_serials.
+
     This should be called early in the startup, such as in the site's
     main urls.py.
     """
     generate_media_serial()
     generate_ajax_serial()
+
+    if getattr(settings, "MEDIA_SERIAL_MANIFEST_PATH", None):
+        generate_media_file_serials()
@@ -0,0 +1,7 @@
+from __future__ import unicode_literals
+
+from django.dispatch import Signal
+
+
+# Emitted by SignalMetricsSink for every metric recorded for the cache.
+cache_metric_recorded = Signal(providing_args=['namespace', 'name', 'value'])
@@ -0,0 +1,136 @@
+from __future__ import unicode_literals
+import logging
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.utils.importlib import import_module
+
+from djblets.cache.backend import cache_memoize
+
+
+class CacheWarmer(object):
+    """A memoized computation that can be filled ahead of time.
+
+    By default, this calls cache_memoize() with the key, lookup callable
+    and any additional arguments it was created with. Those arguments must
+    match the ones used when the data is normally looked up, so that the
+    same cache entry is filled.
+
+    Subclasses can override warm() to fill several related entries.
+    """
+    def __init__(self, key, lookup_callable, **memoize_kwargs):
+        self.key = key
+        self.lookup_callable = lookup_callable
+        self.memoize_kwargs = memoize_kwargs
+
+    def warm(self, force_overwrite=False):
+        """Fills the cache for this computation.
+
+        Unless force_overwrite is True, data that's already in the cache
+        won't be computed again.
+        """
+        cache_memoize(self.key, self.lookup_callable,
+                      force_overwrite=force_overwrite,
+                      **self.memoize_kwargs)
+
+
+class _RateLimiter(object):
+    """Limits how many times per second something can be done.
+
+    This is shared between threads. Each call to wait() blocks until
+    enough time has passed since the previous one.
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_time = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.time()
+            start_time = max(now, self.next_time)
+            self.next_time = start_time + self.interval
+
+        if start_time > now:
+            time.sleep(start_time - now)
+
+
+_cache_warmers = None
+
+
+def get_cache_warmers():
+    """Returns the list of registered cache warmers.
+
+    The modules listed in the CACHE_WARMUP_MODULES setting are imported
+    first, so that they can register their cache warmers.
+    """
+    global _cache_warmers
+
+    if _cache_warmers is None:
+        _cache_warmers = []
+
+        for module_name in getattr(settings, 'CACHE_WARMUP_MODULES', []):
+            import_module(module_name)
+
+    return _cache_warmers
+
+
+def register_cache_warmer(warmer):
+    """Registers a computation to fill when warming up the cache."""
+    get_cache_warmers().append(warmer)
+
+
+def unregister_cache_warmer(warmer):
+    """Unregisters a previously registered cache warmer."""
+    try:
+        get_cache_warmers().remove(warmer)
+    except ValueError:
+        raise ValueError('This cache warmer is not registered.')
+
+
+def warm_cache(warmers=None, num_threads=1, rate=None,
+               force_overwrite=False):
+    """Fills the cache for the registered computations.
+
+    This should be run after a deploy or a cache restart, so that users
+    don't have to wait for each computation to fill the cache.
+
+    Computations are run by num_threads threads at once. If rate is set,
+    no more than that many computations will be started per second, in
+    order to limit the load on the database.
+
+    Returns a list of (warmer, error) tuples, where error is the exception
+    raised while warming the cache, or None if it succeeded.
+    """
+    if warmers is None:
+        warmers = get_cache_warmers()
+
+    if rate:
+        rate_limiter = _RateLimiter(rate)
+    else:
+        rate_limiter = None
+
+    def _warm(warmer):
+        if rate_limiter:
+            rate_limiter.wait()
+
+        try:
+            warmer.warm(force_overwrite=force_overwrite)
+            return warmer, None
+        except Exception as e:
+            logging.exception('Failed to warm the cache for key %s: %s'
+                              % (warmer.key, e))
+            return warmer, e
+
+    if num_threads > 1:
+        pool = ThreadPool(num_threads)
+
+        try:
+            return pool.map(_warm, warmers)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        return [_warm(warmer) for warmer in warmers]
@@ -26,7 +26,12 @@
 from __future__ import unicode_literals
 
 import datetime
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import zlib
 
 from django.conf import settings
 from django.conf.urls import include, patterns, url
@@ -36,19 +41,39 @@ from django.core.exceptions import ValidationError
 from django.core.urlresolvers import NoReverseMatch, reverse
 from django.http import HttpRequest
 from django.template import Token, TOKEN_TEXT, TemplateSyntaxError
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 from django.utils import six
 from django.utils.html import strip_spaces_between_tags
 
-from djblets.cache.backend import (cache_memoize, make_cache_key,
-                                  CACHE_CHUNK_SIZE)
+from djblets.cache.backend import (_decompress_to_buffer,
+                                  cache_memoize, cache_memoize_many,
+                                  CircuitBreakerCache,
+                                  invalidate_namespace, make_cache_key,
+                                  local_cache, LocalCache, CACHE_CHUNK_SIZE,
+                                  MAX_KEY_SIZE)
+from djblets.cache.codecs import (LargeDataCodec, ZlibCodec,
+                                  register_large_data_codec,
+                                  unregister_large_data_codec)
+from djblets.cache.errors import MissingChunkError
+from djblets.cache.metrics import (get_key_namespace, register_metrics_sink,
+                                   unregister_metrics_sink, StatsMetricsSink)
+from djblets.cache.serials import (generate_media_file_serials,
+                                   generate_media_serial,
+                                   get_media_file_serial)
+from djblets.cache.warmup import (CacheWarmer, get_cache_warmers,
+                                  register_cache_warmer,
+                                  unregister_cache_warmer, warm_cache)
 from djblets.db.fields import JSONField
 from djblets.testing.testcases import TestCase, TagTest
 from djblets.urls.resolvers import DynamicURLResolver
 from djblets.util.http import (get_http_accept_lists,
                                get_http_requested_mimetype,
                                is_mimetype_a)
+from djblets.util.compat.six.moves import cPickle as pickle
 from djblets.util.templatetags import (djblets_deco, djblets_email,
                                        djblets_utils)
+from djblets.util.views import cached_javascript_catalog
 
 
 def normalize_html(s):
@@ -58,6 +83,7 @@ def normalize_html(s):
 class CacheTest(TestCase):
     def tearDown(self):
         cache.clear()
+        local_cache.clear()
 
     def test_cache_memoize(self):
         """Testing cache_memoize"""
@@ -76,6 +102,130 @@ class CacheTest(TestCase):
         result = cache_memoize(cacheKey, cacheFunc)
         self.assertEqual(result, testStr)
 
+    def test_cache_memoize_stores_pickled_data(self):
+        """Testing cache_memoize storing data in its pickled form"""
+        data = {'a': [1, 2, 3]}
+
+        self.assertEqual(cache_memoize('abc123', lambda: data), data)
+        self.assertTrue(isinstance(cache.get(make_cache_key('abc123:pickled')),
+                                   bytes))
+        self.assertEqual(cache_memoize('abc123', lambda: None), data)
+
+        # The pickled form shouldn't be where older versions look for data.
+        self.assertEqual(cache.get(make_cache_key('abc123')), None)
+
+    def test_cache_memoize_with_unpickled_data(self):
+        """Testing cache_memoize with data not in its pickled form"""
+        cache.set(make_cache_key('abc123:pickled'), {'a': 1})
+        self.assertEqual(cache_memoize('abc123', lambda: 'new'), 'new')
+
+    def test_cache_memoize_many(self):
+        """Testing cache_memoize_many"""
+        cache_memoize('key1', lambda: 'cached 1')
+
+        def lookup(keys, lookupCalled=[]):
+            self.assertTrue(not lookupCalled)
+            lookupCalled.append(True)
+            self.assertEqual(sorted(keys), ['key2', 'key3'])
+
+            return dict((key, 'computed %s' % key) for key in keys)
+
+        expected = {
+            'key1': 'cached 1',
+            'key2': 'computed key2',
+            'key3': 'computed key3',
+        }
+
+        result = cache_memoize_many(['key1', 'key2', 'key3'], lookup)
+        self.assertEqual(result, expected)
+
+        # Call a second time. We should only call lookup once.
+        result = cache_memoize_many(['key1', 'key2', 'key3'], lookup)
+        self.assertEqual(result, expected)
+
+        self.assertEqual(cache_memoize('key2', lambda: None),
+                         'computed key2')
+
+    def test_cache_memoize_many_with_large_data(self):
+        """Testing cache_memoize_many with keys memoized as large_data"""
+        cache_memoize('key1', lambda: 'cached 1', large_data=True)
+
+        result = cache_memoize_many(
+            ['key1'], lambda keys: dict((key, 'computed') for key in keys))
+        self.assertEqual(result, {'key1': 'computed'})
+
+        self.assertEqual(cache_memoize('key1', lambda: None, large_data=True),
+                         'cached 1')
+
+    def test_cache_memoize_many_without_batch_lookup(self):
+        """Testing cache_memoize_many with batch_lookup=False"""
+        cache_memoize('key1', lambda: 'cached 1')
+
+        result = cache_memoize_many(['key1', 'key2'],
+                                    lambda key: 'computed %s' % key,
+                                    batch_lookup=False)
+        self.assertEqual(result, {
+            'key1': 'cached 1',
+            'key2': 'computed key2',
+        })
+
+    def test_cache_memoize_with_namespaces(self):
+        """Testing cache_memoize with namespaces"""
+        cache_memoize('key1', lambda: 'old 1', namespaces=['ns1'])
+        cache_memoize('key2', lambda: 'old 2', namespaces=['ns1', 'ns2'])
+        cache_memoize('key3', lambda: 'old 3', namespaces=['ns2'])
+
+        self.assertEqual(
+            cache_memoize('key1', lambda: 'new 1', namespaces=['ns1']),
+            'old 1')
+
+        invalidate_namespace('ns1')
+
+        self.assertEqual(
+            cache_memoize('key1', lambda: 'new 1', namespaces=['ns1']),
+            'new 1')
+        self.assertEqual(
+            cache_memoize('key2', lambda: 'new 2',
+                          namespaces=['ns2', 'ns1']),
+            'new 2')
+        self.assertEqual(
+            cache_memoize('key3', lambda: 'new 3', namespaces=['ns2']),
+            'old 3')
+
+    def test_cache_memoize_with_namespaces_and_local_cache(self):
+        """Testing cache_memoize with namespaces and use_local_cache=True"""
+        cache_memoize('key1', lambda: 'old', namespaces=['ns1'],
+                      use_local_cache=True)
+
+        # A generation bumped by another process isn't seen until the local
+        # cache syncs.
+        cache.incr(make_cache_key('namespace-gen:ns1'))
+        self.assertEqual(
+            cache_memoize('key1', lambda: 'new', namespaces=['ns1'],
+                          use_local_cache=True),
+            'old')
+
+        invalidate_namespace('ns1')
+        self.assertEqual(
+            cache_memoize('key1', lambda: 'new', namespaces=['ns1'],
+                          use_local_cache=True),
+            'new')
+
+    def test_cache_memoize_many_with_namespaces(self):
+        """Testing cache_memoize_many with namespaces"""
+        cache_memoize('key1', lambda: 'old 1', namespaces=['ns1'])
+        invalidate_namespace('ns1')
+        cache_memoize('key2', lambda: 'old 2', namespaces=['ns1'])
+
+        result = cache_memoize_many(
+            ['key1', 'key2'],
+            lambda keys: dict((key, 'new') for key in keys),
+            namespaces=['ns1'])
+        self.assertEqual(result, {
+            'key1': 'new',
+            'key2': 'old 2',
+        })
+
     def test_cache_memoize_large_files(self):
         """Testing cache_memoize with large files"""
         cacheKey = "abc123"
@@ -102,6 +252,678 @@ class CacheTest(TestCase):
                                compress_large_data=False)
         self.assertEqual(result, data)
 
+    def test_cache_memoize_promotes_large_data(self):
+        """Testing cache_memoize storing oversized data as large data"""
+        cacheKey = "abc123"
+        data = ['%1024d' % i for i in range(CACHE_CHUNK_SIZE // 1024 + 1)]
+        calls = []
+
+        def cacheFunc():
+            calls.append(True)
+            return data
+
+        sink = StatsMetricsSink()
+        register_metrics_sink(sink)
+
+        try:
+            self.assertEqual(cache_memoize(cacheKey, cacheFunc), data)
+            self.assertEqual(cache_memoize(cacheKey, cacheFunc), data)
+        finally:
+            unregister_metrics_sink(sink)
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(make_cache_key('%s:large' % cacheKey) in cache)
+
+        stats = sink.get_stats()['abc123']
+        self.assertEqual(stats['promoted_large_data']['count'], 1)
+        self.assertTrue(stats['value_size']['max'] > CACHE_CHUNK_SIZE)
+
+    def test_cache_memoize_many_with_promoted_large_data(self):
+        """Testing cache_memoize_many with oversized data"""
+        data1 = ['%1024d' % i for i in range(CACHE_CHUNK_SIZE // 1024 + 1)]
+        data2 = ['%1024d' % -i for i in range(CACHE_CHUNK_SIZE // 1024 + 1)]
+
+        cache_memoize('key1', lambda: data1)
+
+        result = cache_memoize_many(
+            ['key1', 'key2'],
+            lambda keys: dict((key, data2) for key in keys))
+        self.assertEqual(result, {
+            'key1': data1,
+            'key2': data2,
+        })
+
+        self.assertTrue(make_cache_key('key2:large') in cache)
+        self.assertEqual(cache_memoize('key2', lambda: None), data2)
+
+    def test_cache_memoize_large_files_chunk_count(self):
+        """Testing cache_memoize with large files stores all chunks"""
+        cacheKey = "abc123"
+        data = 'x' * (CACHE_CHUNK_SIZE * 2 + 100)
+
+        result = cache_memoize(cacheKey, lambda: data, large_data=True,
+                               compress_large_data=False)
+        self.assertEqual(result, data)
+
+        manifest = cache.get(make_cache_key(cacheKey))
+        self.assertEqual(manifest['chunk_count'], 3)
+
+        for i in range(3):
+            chunk = cache.get(make_cache_key('%s-%d' % (cacheKey, i)))
+            self.assertTrue(chunk is not None)
+
+        result = cache_memoize(cacheKey, lambda: None, large_data=True,
+                               compress_large_data=False)
+        self.assertEqual(result, data)
+
+    def test_cache_memoize_large_files_old_format(self):
+        """Testing cache_memoize with large files stored in the old format"""
+        cacheKey = "abc123"
+        data = 'x' * CACHE_CHUNK_SIZE
+        pickled_data = pickle.dumps(data)
+
+        # Store the entry the way older versions stored it.
+        cache.set(make_cache_key(cacheKey), '2')
+        cache.set(make_cache_key('%s-0' % cacheKey),
+                  [pickled_data[:CACHE_CHUNK_SIZE]])
+        cache.set(make_cache_key('%s-1' % cacheKey),
+                  [pickled_data[CACHE_CHUNK_SIZE:]])
+
+        result = cache_memoize(cacheKey, lambda: None, large_data=True,
+                               compress_large_data=False)
+        self.assertEqual(result, data)
+
+    def test_cache_memoize_large_files_stale_chunk(self):
+        """Testing cache_memoize with large files and a stale chunk"""
+        cacheKey = "abc123"
+        data = 'x' * CACHE_CHUNK_SIZE
+        pickled_data = pickle.dumps(data)
+
+        # Store an entry with numbered chunks and a generation, with a
+        # chunk left over from a different generation.
+        cache.set(make_cache_key(cacheKey), {
+            'chunk_count': 2,
+            'length': len(pickled_data),
+            'checksum': zlib.adler32(pickled_data),
+            'generation': 'new',
+            'codec': 'none',
+        })
+        cache.set(make_cache_key('%s-0' % cacheKey),
+                  [pickled_data[:CACHE_CHUNK_SIZE], 'new'])
+        cache.set(make_cache_key('%s-1' % cacheKey),
+                  [pickled_data[CACHE_CHUNK_SIZE:], 'old'])
+
+        # The mismatched chunk should be treated as a cache miss.
+        result = cache_memoize(cacheKey, lambda: 'recomputed',
+                               large_data=True, compress_large_data=False)
+        self.assertEqual(result, 'recomputed')
+
+    def test_cache_memoize_large_files_shared_chunks(self):
+        """Testing cache_memoize with large files sharing unchanged chunks"""
+        data1 = 'x' * (CACHE_CHUNK_SIZE * 3 + 100)
+        data2 = data1[:-10] + 'y' * 10
+
+        sink = StatsMetricsSink()
+        register_metrics_sink(sink)
+
+        try:
+            cache_memoize('abc123', lambda: data1, large_data=True,
+                          compress_large_data=False,
+                          share_large_data_chunks=True)
+            cache_memoize('def456', lambda: data2, large_data=True,
+                          compress_large_data=False,
+                          share_large_data_chunks=True)
+        finally:
+            unregister_metrics_sink(sink)
+
+        manifest1 = cache.get(make_cache_key('abc123'))
+        manifest2 = cache.get(make_cache_key('def456'))
+        self.assertEqual(manifest1['chunks'][:3], manifest2['chunks'][:3])
+        self.assertNotEqual(manifest1['chunks'][3], manifest2['chunks'][3])
+
+        # Only the last chunk of the second value was stored.
+        stats = sink.get_stats()['def456']
+        self.assertEqual(stats['reused_chunk_count']['total'], 2)
+
+    def test_cache_memoize_large_files_shared_chunks_expiration(self):
+        """Testing cache_memoize with large files and short-lived chunks"""
+        data = 'x' * (CACHE_CHUNK_SIZE * 2 + 100)
+
+        sink = StatsMetricsSink()
+        register_metrics_sink(sink)
+
+        try:
+            cache_memoize('abc123', lambda: data, large_data=True,
+                          compress_large_data=False, expiration=10,
+                          share_large_data_chunks=True)
+            cache_memoize('def456', lambda: data, large_data=True,
+                          compress_large_data=False, expiration=10,
+                          share_large_data_chunks=True)
+            cache_memoize('ghi789', lambda: data, large_data=True,
+                          compress_large_data=False, expiration=1000,
+                          share_large_data_chunks=True)
+        finally:
+            unregister_metrics_sink(sink)
+
+        stats = sink.get_stats()
+        self.assertEqual(stats['def456']['reused_chunk_count']['total'], 3)
+        self.assertEqual(stats['ghi789']['reused_chunk_count']['total'], 0)
+
+    def test_cache_memoize_large_files_evicted_chunk(self):
+        """Testing cache_memoize with large files restoring evicted chunks"""
+        cacheKey = "abc123"
+        data = 'x' * (CACHE_CHUNK_SIZE * 2)
+
+        cache_memoize(cacheKey, lambda: data, large_data=True,
+                      compress_large_data=False, share_large_data_chunks=True)
+        manifest = cache.get(make_cache_key(cacheKey))
+        cache.delete(make_cache_key('chunk-%s' % manifest['chunks'][-1]))
+
+        result = cache_memoize(cacheKey, lambda: data, large_data=True,
+                               compress_large_data=False,
+                               share_large_data_chunks=True)
+        self.assertEqual(result, data)
+        self.assertTrue(make_cache_key('chunk-%s' % manifest['chunks'][-1])
+                        in cache)
+
+        result = cache_memoize(cacheKey, lambda: None, large_data=True,
+                               compress_large_data=False)
+        self.assertEqual(result, data)
+
+    def test_cache_memoize_large_files_with_codec(self):
+        """Testing cache_memoize with large files and large_data_codec"""
+        cacheKey = "abc123"
+        data = 'x' * CACHE_CHUNK_SIZE
+
+        result = cache_memoize(cacheKey, lambda: data, large_data=True,
+                               large_data_codec=ZlibCodec(level=1))
+        self.assertEqual(result, data)
+
+        manifest = cache.get(make_cache_key(cacheKey))
+        self.assertEqual(manifest['codec'], 'zlib')
+        self.assertEqual(manifest['chunk_count'], 1)
+
+        # The codec should be picked up from the manifest when reading.
+        result = cache_memoize(cacheKey, lambda: None, large_data=True,
+                               compress_large_data=False)
+        self.assertEqual(result, data)
+
+    def test_cache_memoize_large_files_with_custom_codec(self):
+        """Testing cache_memoize with large files and a registered codec"""
+        class ReversedCodec(LargeDataCodec):
+            codec_id = 'reversed'
+
+            def compress(self, data):
+                return data[::-1]
+
+            def decompress(self, data):
+                return data[::-1]
+
+        codec = ReversedCodec()
+        register_large_data_codec(codec)
+
+        try:
+            result = cache_memoize("abc123", lambda: 'abc', large_data=True,
+                                   large_data_codec='reversed')
+            self.assertEqual(result, 'abc')
+
+            result = cache_memoize("abc123", lambda: None, large_data=True)
+            self.assertEqual(result, 'abc')
+        finally:
+            unregister_large_data_codec(codec)
+
+    def test_decompress_to_buffer(self):
+        """Testing reading large data from a buffer of decompressed chunks"""
+        chunks = [b'abc', b'de', b'f']
+
+        self.assertEqual(_decompress_to_buffer(list(chunks), 6).read(),
+                         b'abcdef')
+        self.assertEqual(_decompress_to_buffer(list(chunks)).read(),
+                         b'abcdef')
+        self.assertRaises(MissingChunkError, _decompress_to_buffer,
+                          list(chunks), 5)
+        self.assertRaises(MissingChunkError, _decompress_to_buffer,
+                          list(chunks), 7)
+
+    def test_cache_memoize_with_lock(self):
+        """Testing cache_memoize with use_lock=True"""
+        cacheKey = "abc123"
+        testStr = "Test 123"
+
+        result = cache_memoize(cacheKey, lambda: testStr, use_lock=True)
+        self.assertEqual(result, testStr)
+
+        # The lock should be released once the data is stored.
+        self.assertFalse(make_cache_key('%s:lock' % cacheKey) in cache)
+
+        result = cache_memoize(cacheKey, lambda: None, use_lock=True)
+        self.assertEqual(result, testStr)
+
+    def test_cache_memoize_with_lock_timeout(self):
+        """Testing cache_memoize with use_lock=True and a stuck lock holder"""
+        cacheKey = "abc123"
+        testStr = "Test 123"
+
+        # Simulate another process that has taken the lock and died.
+        cache.add(make_cache_key('%s:lock' % cacheKey), True)
+
+        result = cache_memoize(cacheKey, lambda: testStr, use_lock=True,
+                               lock_wait_time=0.3)
+        self.assertEqual(result, testStr)
+        self.assertEqual(cache_memoize(cacheKey, lambda: None), testStr)
+
+    def test_cache_memoize_with_soft_expiration(self):
+        """Testing cache_memoize with soft_expiration"""
+        cacheKey = "abc123"
+
+        result = cache_memoize(cacheKey, lambda: 'old', soft_expiration=0)
+        self.assertEqual(result, 'old')
+
+        # The data is stale, so this caller should refresh it.
+        result = cache_memoize(cacheKey, lambda: 'new', soft_expiration=60)
+        self.assertEqual(result, 'new')
+
+        result = cache_memoize(cacheKey, lambda: None, soft_expiration=60)
+        self.assertEqual(result, 'new')
+
+    def test_cache_memoize_with_soft_expiration_and_lock_held(self):
+        """Testing cache_memoize with soft_expiration and a lock held"""
+        cacheKey = "abc123"
+
+        cache_memoize(cacheKey, lambda: 'old', soft_expiration=0)
+        cache.add(make_cache_key('%s:lock' % cacheKey), True)
+
+        # The stale data should be returned without waiting.
+        result = cache_memoize(cacheKey, lambda: 'new', soft_expiration=60)
+        self.assertEqual(result, 'old')
+
+    def test_cache_memoize_large_files_with_soft_expiration(self):
+        """Testing cache_memoize with large files and soft_expiration"""
+        cacheKey = "abc123"
+        data = 'x' * CACHE_CHUNK_SIZE
+
+        result = cache_memoize(cacheKey, lambda: data, large_data=True,
+                               soft_expiration=60)
+        self.assertEqual(result, data)
+
+        result = cache_memoize(cacheKey, lambda: None, large_data=True,
+                               soft_expiration=60)
+        self.assertEqual(result, data)
+
+    def test_cache_memoize_with_local_cache(self):
+        """Testing cache_memoize with use_local_cache=True"""
+        cacheKey = "abc123"
+        testStr = "Test 123"
+
+        result = cache_memoize(cacheKey, lambda: testStr,
+                               use_local_cache=True)
+        self.assertEqual(result, testStr)
+
+        # The local cache should be used even if the main cache is cleared.
+        cache.delete(make_cache_key('%s:pickled' % cacheKey))
+        result = cache_memoize(cacheKey, lambda: None, use_local_cache=True)
+        self.assertEqual(result, testStr)
+
+    def test_cache_memoize_with_local_cache_expiration(self):
+        """Testing cache_memoize with use_local_cache=True and expiration"""
+        cacheKey = "abc123"
+
+        cache_memoize(cacheKey, lambda: 'old', expiration=0.1,
+                      use_local_cache=True)
+        time.sleep(0.2)
+
+        result = cache_memoize(cacheKey, lambda: 'new', use_local_cache=True)
+        self.assertEqual(result, 'new')
+
+    def test_cache_memoize_with_local_cache_and_soft_expiration(self):
+        """Testing cache_memoize with use_local_cache and soft_expiration"""
+        cacheKey = "abc123"
+
+        cache_memoize(cacheKey, lambda: 'old', soft_expiration=0,
+                      use_local_cache=True)
+
+        # The stale data should be refreshed, rather than served locally.
+        result = cache_memoize(cacheKey, lambda: 'new', soft_expiration=60,
+                               use_local_cache=True)
+        self.assertEqual(result, 'new')
+
+    def test_make_cache_key_with_site_change(self):
+        """Testing make_cache_key after the Site changes"""
+        site = Site.objects.get_current()
+        self.assertEqual(make_cache_key('abc123'),
+                         ('%s:abc123' % site.domain).encode('utf-8'))
+
+        old_domain = site.domain
+        site.domain = 'new.example.com'
+        site.save()
+
+        try:
+            self.assertEqual(make_cache_key('abc123'),
+                             b'new.example.com:abc123')
+        finally:
+            site.domain = old_domain
+            site.save()
+
+    def test_make_cache_key_with_long_key(self):
+        """Testing make_cache_key with keys over the maximum size"""
+        key = make_cache_key('x' * 300)
+        self.assertEqual(len(key), MAX_KEY_SIZE)
+        self.assertEqual(make_cache_key('x' * 300), key)
+
+    def test_cache_memoize_metrics(self):
+        """Testing cache_memoize records metrics"""
+        sink = StatsMetricsSink()
+        register_metrics_sink(sink)
+
+        try:
+            cache_memoize('test-abc123', lambda: 'Test 123')
+            cache_memoize('test-abc123', lambda: None)
+            cache_memoize('test-abc123', lambda: 'x' * CACHE_CHUNK_SIZE,
+                          large_data=True, force_overwrite=True)
+        finally:
+            unregister_metrics_sink(sink)
+
+        stats = sink.get_stats()['test']
+        self.assertEqual(stats['miss']['count'], 1)
+        self.assertEqual(stats['hit']['count'], 1)
+        self.assertEqual(stats['compute_time']['count'], 2)
+        self.assertEqual(sum(stats['compute_time']['histogram']), 2)
+        self.assertEqual(stats['chunk_count']['total'], 1)
+        self.assertTrue(stats['stored_bytes']['total'] > 0)
+
+    def test_get_key_namespace(self):
+        """Testing get_key_namespace"""
+        self.assertEqual(get_key_namespace('feed-http://example.com/'),
+                         'feed')
+        self.assertEqual(get_key_namespace('extensionmgr:foo:gen'),
+                         'extensionmgr')
+        self.assertEqual(get_key_namespace('abc123'), 'abc123')
+
+    def test_local_cache_eviction(self):
+        """Testing LocalCache evicts least recently used entries"""
+        local = LocalCache(max_entries=2)
+        local.set('a', 1)
+        local.set('b', 2)
+        self.assertEqual(local.get('a'), 1)
+
+        local.set('c', 3)
+        self.assertEqual(local.get('b'), None)
+        self.assertEqual(local.get('a'), 1)
+        self.assertEqual(local.get('c'), 3)
+
+        stats = local.get_stats()
+        self.assertEqual(stats['hits'], 3)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['evictions'], 1)
+
+    def test_local_cache_expiration(self):
+        """Testing LocalCache with expired entries"""
+        local = LocalCache()
+        local.set('a', 1, expiration=0)
+        self.assertEqual(local.get('a'), None)
+
+    def test_local_cache_invalidate(self):
+        """Testing LocalCache.invalidate across processes"""
+        local1 = LocalCache(sync_interval=0)
+        local2 = LocalCache(sync_interval=0)
+        local1.set('a', 1)
+        local2.set('a', 2)
+        self.assertEqual(local2.get('a'), 2)
+
+        local1.invalidate()
+        self.assertEqual(local1.get('a'), None)
+        self.assertEqual(local2.get('a'), None)
+
+    def test_circuit_breaker_trips(self):
+        """Testing CircuitBreakerCache falling back on local memory"""
+        class FailingCache(object):
+            calls = 0
+
+            def get(self, key, default=None):
+                self.calls += 1
+                raise IOError('Connection refused')
+
+            set = get
+
+        failing_cache = FailingCache()
+        breaker = CircuitBreakerCache(failing_cache, failure_threshold=2,
+                                      cooldown=60)
+
+        breaker.set('a', 1)
+        self.assertEqual(breaker.get_state()['state'], 'ok')
+        self.assertEqual(breaker.get('a'), 1)
+        self.assertEqual(breaker.get_state()['state'], 'tripped')
+        self.assertEqual(failing_cache.calls, 2)
+
+        # Everything goes to local memory while tripped.
+        breaker.set('b', 2)
+        self.assertEqual(breaker.get('b'), 2)
+        self.assertEqual(failing_cache.calls, 2)
+        self.assertEqual(breaker.get_state()['trip_count'], 1)
+
+    def test_circuit_breaker_recovers(self):
+        """Testing CircuitBreakerCache going back to the backend"""
+        class FlakyCache(object):
+            failing = True
+
+            def get(self, key, default=None):
+                if self.failing:
+                    raise IOError('Connection refused')
+
+                return 'backend'
+
+        flaky_cache = FlakyCache()
+        breaker = CircuitBreakerCache(flaky_cache, failure_threshold=1,
+                                      cooldown=0)
+        self.assertEqual(breaker.get('a'), None)
+        self.assertEqual(breaker.get_state()['state'], 'retrying')
+
+        flaky_cache.failing = False
+        self.assertEqual(breaker.get('a'), 'backend')
+        self.assertEqual(breaker.get_state()['state'], 'ok')
+        self.assertEqual(breaker.get_state()['failures'], 0)
+
+    def test_circuit_breaker_invalidations(self):
+        """Testing CircuitBreakerCache applying invalidations on recovery"""
+        class FlakyCache(object):
+            failing = True
+            deleted_keys = []
+
+            def get(self, key, default=None):
+                if self.failing:
+                    raise IOError('Connection refused')
+
+                return 'backend'
+
+            set = incr = get
+
+            def delete_many(self, keys):
+                self.deleted_keys += keys
+
+        flaky_cache = FlakyCache()
+        breaker = CircuitBreakerCache(flaky_cache, failure_threshold=1,
+                                      cooldown=0)
+        breaker.set('a', 1)
+        self.assertRaises(ValueError, breaker.incr, 'gen')
+        self.assertEqual(breaker.get_state()['pending_invalidations'], 2)
+
+        flaky_cache.failing = False
+        self.assertEqual(breaker.get('a'), 'backend')
+        self.assertEqual(sorted(flaky_cache.deleted_keys), ['a', 'gen'])
+        self.assertEqual(breaker.get_state()['pending_invalidations'], 0)
+
+    def test_circuit_breaker_value_errors(self):
+        """Testing CircuitBreakerCache passing through ValueErrors"""
+        breaker = CircuitBreakerCache(cache, failure_threshold=1)
+        self.assertRaises(ValueError, breaker.incr, 'missing-key')
+        self.assertEqual(breaker.get_state()['failures'], 0)
+
+
+class CacheWarmupTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+
+    def test_warm_cache(self):
+        """Testing warm_cache filling registered computations"""
+        calls = []
+
+        def lookup():
+            calls.append(True)
+            return 'data'
+
+        warmer = CacheWarmer('warmup-test', lookup)
+        register_cache_warmer(warmer)
+
+        try:
+            self.assertTrue(warmer in get_cache_warmers())
+            self.assertEqual(warm_cache(), [(warmer, None)])
+        finally:
+            unregister_cache_warmer(warmer)
+
+        self.assertEqual(cache_memoize('warmup-test', lookup), 'data')
+        self.assertEqual(len(calls), 1)
+
+        warm_cache([warmer], force_overwrite=True)
+        self.assertEqual(len(calls), 2)
+
+    def test_warm_cache_errors(self):
+        """Testing warm_cache reporting failed computations"""
+        def lookup():
+            raise ValueError('Database is down')
+
+        warmer1 = CacheWarmer('warmup-test1', lookup)
+        warmer2 = CacheWarmer('warmup-test2', lambda: 'data')
+        results = warm_cache([warmer1, warmer2], num_threads=2, rate=1000)
+
+        self.assertEqual(results[0][0], warmer1)
+        self.assertTrue(isinstance(results[0][1], ValueError))
+        self.assertEqual(results[1], (warmer2, None))
+
+
+class SerialsTest(TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp(prefix='djblets-serials-')
+        self.static_root = os.path.join(self.tempdir, 'static')
+        self.index_path = os.path.join(self.tempdir, 'serials.json')
+
+        os.makedirs(os.path.join(self.static_root, 'js', 'lib'))
+        self._write_file('css/style.css', 1000)
+        self._write_file('js/lib/lib.js', 3000)
+        self._write_file('js/app.js', 2000)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_generate_media_serial(self):
+        """Testing generate_media_serial"""
+        self.assertEqual(self._generate_media_serial(), 3000)
+        self.assertTrue(os.path.exists(self.index_path))
+
+    def test_generate_media_serial_with_index(self):
+        """Testing generate_media_serial with a serial index"""
+        self.assertEqual(self._generate_media_serial(), 3000)
+
+        # A new file changes the directory's modification time, which
+        # should cause it to be crawled again.
+        self._write_file('css/new.css', 4000)
+        self.assertEqual(self._generate_media_serial(), 4000)
+
+        # Directories that are unchanged shouldn't be crawled again.
+        os.utime(os.path.join(self.static_root, 'js', 'app.js'),
+                 (5000, 5000))
+        self.assertEqual(self._generate_media_serial(), 4000)
+
+    def test_generate_media_serial_with_threads(self):
+        """Testing generate_media_serial with SERIAL_CRAWL_THREADS"""
+        self.assertEqual(self._generate_media_serial(SERIAL_CRAWL_THREADS=4),
+                         3000)
+
+    def test_generate_media_file_serials(self):
+        """Testing generate_media_file_serials"""
+        serials = self._generate_media_file_serials()
+        self.assertEqual(sorted(serials.keys()),
+                         ['css/style.css', 'js/app.js', 'js/lib/lib.js'])
+        self.assertNotEqual(serials['js/app.js'], serials['js/lib/lib.js'])
+
+        # Only the changed file should get a new serial.
+        with open(os.path.join(self.static_root, 'js', 'app.js'), 'w') as fp:
+            fp.write('new content')
+
+        new_serials = self._generate_media_file_serials()
+        self.assertNotEqual(new_serials['js/app.js'], serials['js/app.js'])
+        self.assertEqual(new_serials['js/lib/lib.js'],
+                         serials['js/lib/lib.js'])
+        self.assertEqual(new_serials['css/style.css'],
+                         serials['css/style.css'])
+
+    def test_get_media_file_serial(self):
+        """Testing get_media_file_serial"""
+        with override_settings(MEDIA_SERIAL=1234,
+                               MEDIA_FILE_SERIALS={'js/app.js': 'abc'}):
+            self.assertEqual(get_media_file_serial('js/app.js'), 'abc')
+            self.assertEqual(get_media_file_serial('js/other.js'), 1234)
+
+    def _generate_media_file_serials(self):
+        with override_settings(MEDIA_FILE_SERIALS=None,
+                               STATIC_ROOT=self.static_root,
+                               MEDIA_SERIAL_MANIFEST_PATH=self.index_path):
+            generate_media_file_serials()
+
+            return settings.MEDIA_FILE_SERIALS
+
+    def _generate_media_serial(self, **kwargs):
+        with override_settings(MEDIA_SERIAL=0,
+                               STATIC_ROOT=self.static_root,
+                               SERIAL_INDEX_PATH=self.index_path,
+                               **kwargs):
+            generate_media_serial()
+
+            return settings.MEDIA_SERIAL
+
+    def _write_file(self, path, mtime):
+        path = os.path.join(self.static_root, path)
+        dirname = os.path.dirname(path)
+
+        if not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+        with open(path, 'w') as fp:
+            fp.write(path)
+
+        os.utime(path, (mtime, mtime))
+
+        # Make the directory's modification time distinct from any
+        # previous crawl.
+        dir_mtime = os.stat(dirname).st_mtime + 1
+        os.utime(dirname, (dir_mtime, dir_mtime))
+
+
+class CachedJavaScriptCatalogTests(TestCase):
+    def tearDown(self):
+        cache.clear()
+        local_cache.clear()
+
+    def test_cached_javascript_catalog(self):
+        """Testing cached_javascript_catalog"""
+        request = RequestFactory().get('/jsi18n/')
+        response = cached_javascript_catalog(request, packages=['djblets'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['ETag'])
+        self.assertTrue(response.content)
+
+    def test_cached_javascript_catalog_with_etag(self):
+        """Testing cached_javascript_catalog with a matching ETag"""
+        request = RequestFactory().get('/jsi18n/')
+        etag = cached_javascript_catalog(request,
+                                         packages=['djblets'])['ETag']
+
+        request = RequestFactory().get('/jsi18n/', HTTP_IF_NONE_MATCH=etag)
+        response = cached_javascript_catalog(request, packages=['djblets'],
+                                             max_age=3600)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response['Cache-Control'], 'max-age=3600')
+
 
 class BoxTest(TagTest):
     def testPlain(self):
@@ -1,28 +1,65 @@
 from __future__ import unicode_literals
+from hashlib import md5
 
+from django.conf import settings
+from django.http import HttpResponseNotModified
+from django.utils.cache import patch_cache_control
 from django.utils.translation import get_language
 from django.views.i18n import javascript_catalog
 
 from djblets.cache.backend import cache_memoize
 from djblets.cache.serials import generate_locale_serial
+from djblets.util.http import etag_if_none_match, set_etag
 
 
-locale_serials = {}
+# How long a locale serial is shared between processes before it's
+# computed again. Updated translations are picked up within this time.
+LOCALE_SERIAL_EXPIRATION = getattr(settings, 'LOCALE_SERIAL_EXPIRATION',
+                                   10 * 60)
 
 
-def cached_javascript_catalog(request, domain='djangojs', packages=None):
-    """A cached version of javascript_catalog."""
-    global locale_serials
+def get_locale_serial(packages):
+    """Returns the locale serial for a set of packages.
 
+    The serial is computed by one process and shared with the others through
+    the cache, so that every process doesn't need to crawl the locale
+    directories.
+    """
+    return cache_memoize('jsi18n-serial-%s' % '_'.join(packages),
+                         lambda: generate_locale_serial(packages),
+                         expiration=LOCALE_SERIAL_EXPIRATION,
+                         use_local_cache=True)
+
+
+def cached_javascript_catalog(request, domain='djangojs', packages=None,
+                              max_age=None):
+    """A cached version of javascript_catalog.
+
+    The response has an ETag based on the locale serial, so clients that
+    already have the catalog get a 304 Not Modified without the catalog
+    being fetched from the cache. The response can be cached by clients for
+    max_age seconds (defaulting to settings.JS_CATALOG_MAX_AGE, or 0), which
+    should only be raised if the catalog's URL changes with the serial.
+    """
     package_str = '_'.join(packages)
-    try:
-        serial = locale_serials[package_str]
-    except KeyError:
-        serial = generate_locale_serial(packages)
-        locale_serials[package_str] = serial
-
-    return cache_memoize(
-        'jsi18n-%s-%s-%s-%d' % (domain, package_str, get_language(), serial),
-        lambda: javascript_catalog(request, domain, packages),
-        large_data=True,
-        compress_large_data=True)
+    language = get_language()
+    serial = get_locale_serial(packages)
+    etag = '"%s"' % md5(('%s:%s:%s:%d' % (domain, package_str, language,
+                                          serial)).encode('utf-8')).hexdigest()
+
+    if max_age is None:
+        max_age = getattr(settings, 'JS_CATALOG_MAX_AGE', 0)
+
+    if etag_if_none_match(request, etag):
+        response = HttpResponseNotModified()
+    else:
+        response = cache_memoize(
+            'jsi18n-%s-%s-%s-%d' % (domain, package_str, language, serial),
+            lambda: javascript_catalog(request, domain, packages),
+            large_data=True,
+            compress_large_data=True)
+
+    set_etag(response, etag)
+    patch_cache_control(response, max_age=max_age)
+
+    return response
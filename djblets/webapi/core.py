@@ -26,21 +26,33 @@
 
 from __future__ import unicode_literals
 
+import base64
 import json
-from xml.sax.saxutils import XMLGenerator
+import types
+from hashlib import md5
+from xml.sax.saxutils import escape, quoteattr
 
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.db.models.fields import FieldDoesNotExist
+from django.db.models.sql.datastructures import EmptyResultSet
 from django.http import HttpResponse
 from django.utils import six
 from django.utils.encoding import force_unicode
 
-from djblets.util.compat.six.moves import cStringIO as StringIO
+from djblets.cache.backend import cache_memoize
 from djblets.util.http import get_http_requested_mimetype, is_mimetype_a
 from djblets.webapi.errors import INVALID_FORM_DATA
 
 
 SPECIAL_PARAMS = ('api_format', 'callback', '_method', 'expand')
 
+# How WebAPIResponsePaginated reports the total number of results.
+TOTAL_RESULTS_EXACT = 'exact'
+TOTAL_RESULTS_CACHED = 'cached'
+TOTAL_RESULTS_NONE = 'none'
+
 
 class WebAPIEncoder(object):
     """
@@ -70,6 +82,41 @@ class WebAPIEncoder(object):
         return None
 
 
+class MultiEncoder(WebAPIEncoder):
+    """
+    Encodes objects using the first of a list of encoders that supports them.
+
+    The encoder that supported an object is remembered for the object's
+    type, and is tried first for later objects of the same type, rather
+    than trying each encoder in turn. This assumes that encoders decide
+    whether they support an object based on its type.
+    """
+
+    def __init__(self, encoders):
+        self.encoders = encoders
+        self._type_encoders = {}
+
+    def encode(self, o, *args, **kwargs):
+        o_type = type(o)
+        type_encoder = self._type_encoders.get(o_type)
+
+        if type_encoder is not None:
+            result = type_encoder.encode(o, *args, **kwargs)
+
+            if result is not None:
+                return result
+
+        for encoder in self.encoders:
+            if encoder is not type_encoder:
+                result = encoder.encode(o, *args, **kwargs)
+
+                if result is not None:
+                    self._type_encoders[o_type] = encoder
+                    return result
+
+        return None
+
+
 class JSONEncoderAdapter(json.JSONEncoder):
     """
     Adapts a WebAPIEncoder to be used with json.
@@ -108,90 +155,205 @@ class XMLEncoderAdapter(object):
     Adapts a WebAPIEncoder to output XML.
 
     This takes an existing encoder and adapts it to output a simple XML format.
+
+    The XML is built up as a list of escaped fragments, which are joined
+    once at the end. Each value is written by a function looked up by its
+    type. Indentation can be turned off with indent=False for smaller
+    output, and iterencode() can be used to generate the XML in pieces.
     """
 
-    def __init__(self, encoder, *args, **kwargs):
+    def __init__(self, encoder, indent=True, *args, **kwargs):
         self.encoder = encoder
+        self.indent = indent
 
     def encode(self, o, *args, **kwargs):
-        self.level = 0
-        self.doIndent = False
+        content = ''.join(self.iterencode(o, *args, **kwargs))
+
+        if six.PY2:
+            content = content.encode(settings.DEFAULT_CHARSET,
+                                     'xmlcharrefreplace')
 
-        stream = StringIO()
-        self.xml = XMLGenerator(stream, settings.DEFAULT_CHARSET)
-        self.xml.startDocument()
-        self.startElement("rsp")
-        self.__encode(o, *args, **kwargs)
-        self.endElement("rsp")
-        self.xml.endDocument()
-        self.xml = None
+        return content
 
-        return stream.getvalue()
+    def iterencode(self, o, *args, **kwargs):
+        """
+        Encodes an object, yielding the XML in pieces.
+
+        If the object is a dictionary, a piece is yielded after each of its
+        keys, and after each item in any of its lists, tuples or
+        generators. The items of a generator are encoded as they're
+        generated, allowing large lists to be encoded without holding all
+        of their items in memory.
+        """
+        self._level = 0
+        self._do_indent = False
+        self._buffer = []
+        self._write = self._buffer.append
+
+        self._write('<?xml version="1.0" encoding="%s"?>\n'
+                    % settings.DEFAULT_CHARSET)
+        self._start_element('rsp')
 
-    def __encode(self, o, *args, **kwargs):
         if isinstance(o, dict):
             for key, value in six.iteritems(o):
-                attrs = {}
-
-                if isinstance(key, six.integer_types):
-                    attrs['value'] = str(key)
-                    key = 'int'
-
-                self.startElement(key, attrs)
-                self.__encode(value, *args, **kwargs)
-                self.endElement(key)
-        elif isinstance(o, (tuple, list)):
-            self.startElement("array")
-
-            for i in o:
-                self.startElement("item")
-                self.__encode(i, *args, **kwargs)
-                self.endElement("item")
-
-            self.endElement("array")
-        elif isinstance(o, six.string_types):
-            self.text(o)
-        elif isinstance(o, six.integer_types):
-            self.text("%d" % o)
-        elif isinstance(o, bool):
-            if o:
-                self.text("True")
-            else:
-                self.text("False")
-        elif o is None:
-            pass
+                name = self._start_key_element(key)
+
+                if isinstance(value, (tuple, list, types.GeneratorType)):
+                    self._start_element('array')
+
+                    for item in value:
+                        self._start_element('item')
+                        self._write_value(item, args, kwargs)
+                        self._end_element('item')
+
+                        yield self._flush()
+
+                    self._end_element('array')
+                else:
+                    self._write_value(value, args, kwargs)
+
+                self._end_element(name)
+
+                yield self._flush()
+        else:
+            self._write_value(o, args, kwargs)
+
+        self._end_element('rsp')
+
+        yield self._flush()
+
+    def _flush(self):
+        content = ''.join(self._buffer)
+        del self._buffer[:]
+
+        return content
+
+    def _write_value(self, o, args, kwargs):
+        try:
+            writer = self._writers[type(o)]
+        except KeyError:
+            writer = self._get_writer(type(o))
+
+        writer(self, o, args, kwargs)
+
+    def _get_writer(self, value_type):
+        """
+        Returns the function used to write values of a type.
+
+        This is only needed the first time a type is seen. The result is
+        stored for later values of the same type.
+        """
+        if issubclass(value_type, dict):
+            writer = XMLEncoderAdapter._write_dict
+        elif issubclass(value_type, (tuple, list)):
+            writer = XMLEncoderAdapter._write_list
+        elif issubclass(value_type, six.string_types):
+            writer = XMLEncoderAdapter._write_text
+        elif issubclass(value_type, six.integer_types):
+            writer = XMLEncoderAdapter._write_int
         else:
-            result = self.encoder.encode(o, *args, **kwargs)
+            writer = XMLEncoderAdapter._write_encoded
 
-            if result is None:
-                raise TypeError("%r is not XML serializable" % (o,))
+        # In Python 2, these are unbound methods. They're stored as plain
+        # functions, like the rest of the writers.
+        writer = six.get_unbound_function(writer)
+        self._writers[value_type] = writer
 
-            return self.__encode(result, *args, **kwargs)
+        return writer
 
-    def startElement(self, name, attrs={}):
-        self.addIndent()
-        self.xml.startElement(name, attrs)
-        self.level += 1
-        self.doIndent = True
+    def _write_dict(self, o, args, kwargs):
+        for key, value in six.iteritems(o):
+            name = self._start_key_element(key)
+            self._write_value(value, args, kwargs)
+            self._end_element(name)
 
-    def endElement(self, name):
-        self.level -= 1
-        self.addIndent()
-        self.xml.endElement(name)
-        self.doIndent = True
+    def _write_list(self, o, args, kwargs):
+        self._start_element('array')
 
-    def text(self, value):
-        self.xml.characters(value)
-        self.doIndent = False
+        for item in o:
+            self._start_element('item')
+            self._write_value(item, args, kwargs)
+            self._end_element('item')
 
-    def addIndent(self):
-        if self.doIndent:
-            self.xml.ignorableWhitespace('\n' + ' ' * self.level)
+        self._end_element('array')
+
+    def _write_text(self, o, args, kwargs):
+        if not isinstance(o, six.text_type):
+            o = o.decode(settings.DEFAULT_CHARSET)
+
+        self._write(escape(o))
+        self._do_indent = False
+
+    def _write_int(self, o, args, kwargs):
+        # Booleans are integers, and are written as 1 or 0.
+        self._write('%d' % o)
+        self._do_indent = False
+
+    def _write_none(self, o, args, kwargs):
+        pass
+
+    def _write_encoded(self, o, args, kwargs):
+        result = self.encoder.encode(o, *args, **kwargs)
+
+        if result is None:
+            raise TypeError("%r is not XML serializable" % (o,))
+
+        self._write_value(result, args, kwargs)
+
+    _writers = {
+        dict: _write_dict,
+        list: _write_list,
+        tuple: _write_list,
+        six.text_type: _write_text,
+        str: _write_text,
+        bool: _write_int,
+        type(None): _write_none,
+    }
+
+    for _type in six.integer_types:
+        _writers[_type] = _write_int
+
+    del _type
+
+    def _start_key_element(self, key):
+        """
+        Starts the element for a key in a dictionary, returning its name.
+        """
+        if isinstance(key, six.integer_types):
+            self._start_element('int', ' value=%s' % quoteattr(str(key)))
+            return 'int'
+        else:
+            self._start_element(key)
+            return key
+
+    def _start_element(self, name, attrs=''):
+        if self._do_indent and self.indent:
+            self._write('\n' + ' ' * self._level)
+
+        self._write('<%s%s>' % (name, attrs))
+        self._level += 1
+        self._do_indent = True
+
+    def _end_element(self, name):
+        self._level -= 1
+
+        if self._do_indent and self.indent:
+            self._write('\n' + ' ' * self._level)
+
+        self._write('</%s>' % name)
+        self._do_indent = True
 
 
 class WebAPIResponse(HttpResponse):
     """
     An API response, formatted for the desired file format.
+
+    If stream_key is set, the value for that key in obj is an iterable of
+    items that will be encoded one at a time as the response is sent,
+    rather than all at once. This keeps the memory needed for large lists
+    bounded by the size of each item. The response then behaves like a
+    StreamingHttpResponse: it has no content attribute, and middleware must
+    use streaming_content instead.
     """
     supported_mimetypes = [
         'application/json',
@@ -200,7 +362,7 @@ class WebAPIResponse(HttpResponse):
 
     def __init__(self, request, obj={}, stat='ok', api_format=None,
                  status=200, headers={}, encoders=[],
-                 mimetype=None, supported_mimetypes=None):
+                 mimetype=None, supported_mimetypes=None, stream_key=None):
         if not api_format:
             if request.method == 'GET':
                 api_format = request.GET.get('api_format', None)
@@ -240,6 +402,8 @@ class WebAPIResponse(HttpResponse):
         self.content_set = False
         self.mimetype = mimetype
         self.encoders = encoders or get_registered_encoders()
+        self.stream_key = stream_key
+        self.streaming = stream_key is not None
 
         for header, value in six.iteritems(headers):
             self[header] = value
@@ -257,23 +421,65 @@ class WebAPIResponse(HttpResponse):
         generating it up-front in the constructor. This is used so that
         the @webapi decorator can set the appropriate API format before
         the content is generated, but after the response is created.
+
+        Streamed responses have no content, as with StreamingHttpResponse.
         """
-        class MultiEncoder(WebAPIEncoder):
-            def __init__(self, encoders):
-                self.encoders = encoders
+        if self.streaming:
+            raise AttributeError('This %s instance is streamed, and has no '
+                                 '`content` attribute. Use '
+                                 '`streaming_content` instead.'
+                                 % self.__class__.__name__)
 
-            def encode(self, *args, **kwargs):
-                for encoder in self.encoders:
-                    result = encoder.encode(*args, **kwargs)
+        self._generate_content()
 
-                    if result is not None:
-                        return result
+        return super(WebAPIResponse, self).content
 
-                return None
+    def _set_content(self, value):
+        HttpResponse.content.fset(self, value)
+
+    content = property(_get_content, _set_content)
+
+    def _get_streaming_content(self):
+        """
+        Returns an iterator over the API response content.
 
+        This is used instead of the content when the response is streamed.
+        The iterator is kept apart from HttpResponse's content, which
+        doesn't support streaming.
+        """
+        self._generate_content()
+
+        return (self.make_bytes(chunk) for chunk in self._stream)
+
+    def _set_streaming_content(self, value):
+        self._stream = iter(value)
+        self.content_set = True
+
+    streaming_content = property(_get_streaming_content,
+                                 _set_streaming_content)
+
+    def __iter__(self):
+        self._generate_content()
+
+        if self.streaming:
+            # HttpResponse's next() encodes each chunk as it's sent.
+            self._iterator = self._stream
+
+            return self
+
+        return super(WebAPIResponse, self).__iter__()
+
+    def _generate_content(self):
+        """
+        Generates the API response content, if it hasn't been already.
+        """
         if not self.content_set:
             adapter = None
-            encoder = MultiEncoder(self.encoders)
+
+            if self.encoders is get_registered_encoders():
+                encoder = _get_registered_multi_encoder()
+            else:
+                encoder = MultiEncoder(self.encoders)
 
             # See the note above about the check for text/plain.
             if (self.mimetype == 'text/plain' or
@@ -284,20 +490,48 @@ class WebAPIResponse(HttpResponse):
             else:
                 assert False
 
-            content = adapter.encode(self.api_data, request=self.request)
+            if self.stream_key is not None:
+                self.streaming_content = self._iter_content(adapter)
+            else:
+                content = adapter.encode(self.api_data, request=self.request)
 
-            if self.callback != None:
-                content = "%s(%s);" % (self.callback, content)
+                if self.callback != None:
+                    content = "%s(%s);" % (self.callback, content)
 
-            self.content = content
-            self.content_set = True
+                self.content = content
+                self.content_set = True
 
-        return super(WebAPIResponse, self).content
+    def _iter_content(self, adapter):
+        """
+        Yields the content, encoding the streamed items one at a time.
+        """
+        if self.callback != None:
+            yield "%s(" % self.callback
 
-    def _set_content(self, value):
-        HttpResponse.content.fset(self, value)
+        if isinstance(adapter, XMLEncoderAdapter):
+            for content in adapter.iterencode(self.api_data,
+                                              request=self.request):
+                yield content
+        else:
+            # The rest of the payload is encoded up-front, with its closing
+            # brace stripped so the streamed items can be added after the
+            # other keys. The payload always contains 'stat'.
+            data = self.api_data.copy()
+            items = data.pop(self.stream_key)
 
-    content = property(_get_content, _set_content)
+            yield adapter.encode(data, request=self.request)[:-1]
+            yield ', %s: [' % json.dumps(self.stream_key)
+
+            for i, item in enumerate(items):
+                if i > 0:
+                    yield ', '
+
+                yield adapter.encode(item, request=self.request)
+
+            yield ']}'
+
+        if self.callback != None:
+            yield ");"
 
 
 class WebAPIResponsePaginated(WebAPIResponse):
@@ -308,18 +542,43 @@ class WebAPIResponsePaginated(WebAPIResponse):
 
     * start - The index of the first item (0-based index).
     * max-results - The maximum number of results to return in the request.
+    * total-results - If set to 1, the exact total number of results will
+      be returned, regardless of total_results_mode.
+
+    Counting the total number of results can be more expensive than
+    fetching the results themselves on large tables. total_results_mode
+    controls how the total is reported:
+
+    * TOTAL_RESULTS_EXACT - The results are counted on every request.
+    * TOTAL_RESULTS_CACHED - The count is cached for total_results_expiration
+      seconds, so it may be slightly out of date.
+    * TOTAL_RESULTS_NONE - The total isn't included unless requested.
+
+    If the exact count isn't computed, one more result than needed is
+    fetched to determine whether there's a next page.
+
+    If paginate_by_cursor is True, the prev and next links contain an
+    opaque cursor parameter instead of start. The cursor holds the values
+    that the queryset is ordered by for the first or last result on the
+    page, and the adjacent page is found by filtering on those values. Deep
+    pages then cost as little as the first page, since the database doesn't
+    need to skip over all the results before them. This requires the
+    queryset to be ordered by fields on its model (the primary key is added
+    to make the ordering unique) that can't be NULL and aren't relations.
+    Requests that pass start, or querysets that can't be ordered this way,
+    use start-based pagination instead.
+
+    If stream_results is True, the results are serialized and encoded one at
+    a time as the response is sent. See WebAPIResponse's stream_key.
     """
     def __init__(self, request, queryset, results_key="results",
                  prev_key="prev", next_key="next",
                  total_results_key="total_results",
                  default_max_results=25, max_results_cap=200,
                  serialize_object_func=None,
-                 extra_data={}, *args, **kwargs):
-        try:
-            start = max(int(request.GET.get('start', 0)), 0)
-        except ValueError:
-            start = 0
-
+                 extra_data={}, total_results_mode=TOTAL_RESULTS_EXACT,
+                 total_results_expiration=60, paginate_by_cursor=False,
+                 stream_results=False, *args, **kwargs):
         try:
             max_results = \
                 min(int(request.GET.get('max-results', default_max_results)),
@@ -327,12 +586,57 @@ class WebAPIResponsePaginated(WebAPIResponse):
         except ValueError:
             max_results = default_max_results
 
-        results = queryset[start:start + max_results]
+        if request.GET.get('total-results') in ('1', 'true', 'True'):
+            total_results_mode = TOTAL_RESULTS_EXACT
+
+        full_path = request.build_absolute_uri(request.path)
+        ordering = None
 
-        total_results = queryset.count()
+        if paginate_by_cursor and 'start' not in request.GET:
+            ordering = self._get_cursor_ordering(queryset)
 
-        if total_results == 0:
-            results = []
+        if ordering:
+            results, prev_href, next_href = self._get_cursor_page(
+                request, queryset, ordering, max_results, full_path)
+            total_results = self._get_total_results(
+                queryset, total_results_mode, total_results_expiration)
+        else:
+            try:
+                start = max(int(request.GET.get('start', 0)), 0)
+            except ValueError:
+                start = 0
+
+            if total_results_mode == TOTAL_RESULTS_EXACT:
+                results = queryset[start:start + max_results]
+                total_results = queryset.count()
+
+                if total_results == 0:
+                    results = []
+
+                has_next = start + len(results) < total_results
+            else:
+                results = list(queryset[start:start + max_results + 1])
+                has_next = len(results) > max_results
+                results = results[:max_results]
+                total_results = self._get_total_results(
+                    queryset, total_results_mode, total_results_expiration)
+
+            prev_href = None
+            next_href = None
+
+            if start > 0:
+                prev_href = '%s?start=%s&max-results=%s' % (
+                    full_path, max(start - max_results, 0), max_results)
+
+            if has_next:
+                next_href = '%s?start=%s&max-results=%s' % (
+                    full_path, start + max_results, max_results)
+
+        if stream_results:
+            if serialize_object_func:
+                results = (serialize_object_func(obj) for obj in results)
+
+            kwargs['stream_key'] = results_key
         elif serialize_object_func:
             results = [serialize_object_func(obj)
                        for obj in results]
@@ -341,28 +645,199 @@ class WebAPIResponsePaginated(WebAPIResponse):
 
         data = {
             results_key: results,
-            total_results_key: total_results,
         }
-        data.update(extra_data)
 
-        full_path = request.build_absolute_uri(request.path)
+        if total_results is not None:
+            data[total_results_key] = total_results
 
-        if start > 0:
+        data.update(extra_data)
+
+        if prev_href:
             data['links'][prev_key] = {
                 'method': 'GET',
-                'href': '%s?start=%s&max-results=%s' %
-                        (full_path, max(start - max_results, 0), max_results),
+                'href': prev_href,
             }
 
-        if start + len(results) < total_results:
+        if next_href:
             data['links'][next_key] = {
                 'method': 'GET',
-                'href': '%s?start=%s&max-results=%s' %
-                        (full_path, start + max_results, max_results),
+                'href': next_href,
             }
 
         WebAPIResponse.__init__(self, request, obj=data, *args, **kwargs)
 
+    def _get_total_results(self, queryset, total_results_mode, expiration):
+        """Returns the total number of results, or None if not wanted."""
+        if total_results_mode == TOTAL_RESULTS_EXACT:
+            return queryset.count()
+        elif total_results_mode == TOTAL_RESULTS_CACHED:
+            return self._get_cached_count(queryset, expiration)
+        else:
+            return None
+
+    def _get_cached_count(self, queryset, expiration):
+        """Returns the number of results, caching it for later requests."""
+        try:
+            sql = six.text_type(queryset.query)
+        except EmptyResultSet:
+            return 0
+
+        return cache_memoize(
+            'webapi-total-results-%s'
+            % md5(sql.encode('utf-8')).hexdigest(),
+            queryset.count,
+            expiration=expiration)
+
+    def _get_cursor_ordering(self, queryset):
+        """Returns the ordering to use for cursors.
+
+        This is a list of (field, descending) tuples, ending with the
+        primary key. If the queryset's ordering can't be used for cursors,
+        None is returned.
+
+        Fields that can be NULL can't be used, since NULL values never
+        match the filters used to find the adjacent pages. Relations can't
+        be used either, since they're ordered by the related model's
+        ordering rather than by the value the filters compare. Orderings
+        added through extra() can't be used, since they replace the
+        ordering on the fields the filters compare.
+        """
+        opts = queryset.model._meta
+
+        if queryset.query.extra_order_by:
+            return None
+
+        if queryset.query.order_by:
+            order_by = queryset.query.order_by
+        elif queryset.query.default_ordering:
+            order_by = opts.ordering
+        else:
+            order_by = []
+
+        ordering = []
+
+        for name in order_by:
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+
+            if name == 'pk':
+                field = opts.pk
+            else:
+                try:
+                    field = opts.get_field(name)
+                except FieldDoesNotExist:
+                    # This is a random ordering, or one across relations.
+                    return None
+
+            if field.null or field.rel:
+                return None
+
+            ordering.append((field, descending))
+
+            if field.primary_key:
+                return ordering
+
+        if opts.pk.rel:
+            return None
+
+        if ordering:
+            descending = ordering[-1][1]
+        else:
+            descending = False
+
+        ordering.append((opts.pk, descending))
+
+        return ordering
+
+    def _get_cursor_page(self, request, queryset, ordering, max_results,
+                         full_path):
+        """Returns the results for a cursor, and links to adjacent pages."""
+        try:
+            direction, values = json.loads(
+                base64.urlsafe_b64decode(
+                    request.GET['cursor'].encode('utf-8')).decode('utf-8'))
+
+            if len(values) != len(ordering):
+                raise ValueError('The cursor does not match the ordering.')
+
+            values = [field.to_python(value)
+                      for (field, descending), value in zip(ordering, values)]
+            reverse = (direction == 'prev')
+            queryset = queryset.filter(
+                self._build_cursor_q(ordering, values, reverse))
+            has_cursor = True
+        except (KeyError, TypeError, ValueError, ValidationError):
+            # There's no valid cursor, so this is the first page.
+            reverse = False
+            has_cursor = False
+
+        queryset = queryset.order_by(*[
+            '%s%s' % ('-' if descending != reverse else '', field.name)
+            for field, descending in ordering
+        ])
+
+        results = list(queryset[:max_results + 1])
+        has_more = len(results) > max_results
+        results = results[:max_results]
+        prev_href = None
+        next_href = None
+
+        if reverse:
+            results.reverse()
+            has_prev = has_more
+            has_next = True
+        else:
+            has_prev = has_cursor
+            has_next = has_more
+
+        if results:
+            if has_prev:
+                prev_href = self._build_cursor_href(
+                    full_path, 'prev', ordering, results[0], max_results)
+
+            if has_next:
+                next_href = self._build_cursor_href(
+                    full_path, 'next', ordering, results[-1], max_results)
+
+        return results, prev_href, next_href
+
+    def _build_cursor_q(self, ordering, values, reverse):
+        """Returns a filter for the results after the cursor's values.
+
+        If reverse is True, the filter is for the results before them.
+        """
+        q = None
+
+        for i, (field, descending) in enumerate(ordering):
+            if descending != reverse:
+                lookup = 'lt'
+            else:
+                lookup = 'gt'
+
+            field_q = Q(**{'%s__%s' % (field.name, lookup): values[i]})
+
+            for (prev_field, prev_descending), value in zip(ordering[:i],
+                                                            values[:i]):
+                field_q &= Q(**{prev_field.name: value})
+
+            if q is None:
+                q = field_q
+            else:
+                q |= field_q
+
+        return q
+
+    def _build_cursor_href(self, full_path, direction, ordering, obj,
+                           max_results):
+        """Returns a link to the page before or after an object."""
+        cursor = base64.urlsafe_b64encode(json.dumps([
+            direction,
+            [field.value_to_string(obj) for field, descending in ordering],
+        ]).encode('utf-8')).decode('utf-8')
+
+        return '%s?cursor=%s&max-results=%s' % (full_path, cursor,
+                                                max_results)
+
 
 class WebAPIResponseError(WebAPIResponse):
     """
@@ -407,6 +882,7 @@ class WebAPIResponseFormError(WebAPIResponseError):
 
 
 __registered_encoders = None
+__registered_multi_encoder = None
 
 def get_registered_encoders():
     """
@@ -435,6 +911,21 @@ def get_registered_encoders():
     return __registered_encoders
 
 
+def _get_registered_multi_encoder():
+    """
+    Returns a MultiEncoder for the registered Web API encoders.
+
+    This is shared between responses, so that the encoders chosen for each
+    type are remembered across requests.
+    """
+    global __registered_multi_encoder
+
+    if __registered_multi_encoder is None:
+        __registered_multi_encoder = MultiEncoder(get_registered_encoders())
+
+    return __registered_multi_encoder
+
+
 # Backwards-compatibility
 #
 # This must be done after the classes in order to avoid a
@@ -7,6 +7,11 @@ from django.db.models.query import QuerySet
 from djblets.webapi.core import WebAPIEncoder
 
 
+# DjangoJSONEncoder.default() doesn't depend on any state, so a single
+# instance is shared rather than constructing one for every object.
+_json_encoder = DjangoJSONEncoder()
+
+
 class BasicAPIEncoder(WebAPIEncoder):
     """
     A basic encoder that encodes dates, times, QuerySets, Users, and Groups.
@@ -31,7 +36,7 @@ class BasicAPIEncoder(WebAPIEncoder):
             }
         else:
             try:
-                return DjangoJSONEncoder().default(o)
+                return _json_encoder.default(o)
             except TypeError:
                 return None
 
@@ -50,6 +55,6 @@ class ResourceAPIEncoder(WebAPIEncoder):
             return resource.serialize_object(o, *args, **kwargs)
 
         try:
-            return DjangoJSONEncoder().default(o)
+            return _json_encoder.default(o)
         except TypeError:
             return None
@@ -1,5 +1,6 @@
 from __future__ import unicode_literals
 
+import json
 from hashlib import sha1
 
 from django.conf.urls import include, patterns, url
@@ -16,6 +17,7 @@ from django.http import (HttpResponseNotAllowed, HttpResponse,
 from django.utils import six
 from django.views.decorators.vary import vary_on_headers
 
+from djblets.cache.backend import cache_memoize
 from djblets.util.decorators import augment_method_from
 from djblets.util.http import (get_modified_since, etag_if_none_match,
                                set_last_modified, set_etag,
@@ -25,7 +27,8 @@ from djblets.webapi.auth import check_login
 from djblets.webapi.core import (WebAPIResponse,
                                  WebAPIResponseError,
                                  WebAPIResponsePaginated,
-                                 SPECIAL_PARAMS)
+                                 SPECIAL_PARAMS,
+                                 TOTAL_RESULTS_EXACT)
 from djblets.webapi.decorators import (webapi_login_required,
                                        webapi_request_fields,
                                        webapi_response_errors)
@@ -265,6 +268,42 @@ class WebAPIResource(object):
     a string.
 
 
+    Server-side Caching
+    -------------------
+
+    Resources with ETags can also cache their encoded item responses on the
+    server by setting ``cache_responses``. When an object's ETag hasn't
+    changed, the response is sent from the cache without serializing or
+    encoding the object again.
+
+    Cached responses are keyed on the ETag, the host and path of the
+    request, and the ``expand``, ``api_format`` (through the mimetype) and
+    ``callback`` parameters, and are kept for ``response_cache_expiration``
+    seconds. Other query parameters don't affect the key. This should only
+    be enabled if the ETag changes whenever anything in the payload would,
+    including any differences between users.
+
+
+    Large list responses
+    --------------------
+
+    Counting the results for a list resource can be expensive on large
+    tables. ``list_total_results_mode`` can be set to
+    ``TOTAL_RESULTS_CACHED`` to use a recently cached count, or
+    ``TOTAL_RESULTS_NONE`` to leave the count out unless the client passes
+    ``total-results=1``.
+
+    Paging through a list with ``start`` gets slower the further in the page
+    is. If the list's queryset is ordered by fields on its model that can't
+    be NULL and aren't relations, ``list_paginate_by_cursor`` can be set so
+    that the links to the previous and next pages use cursors instead, which
+    cost the same for any page.
+
+    Large pages of results can be serialized and encoded one at a time as
+    the response is sent by setting ``list_stream_results``, rather than
+    being built up in memory first.
+
+
     Mimetypes
     ---------
 
@@ -323,9 +362,14 @@ class WebAPIResource(object):
     last_modified_field = None
     etag_field = None
     autogenerate_etags = False
+    cache_responses = False
+    response_cache_expiration = 24 * 60 * 60
     singleton = False
     list_child_resources = []
     item_child_resources = []
+    list_total_results_mode = TOTAL_RESULTS_EXACT
+    list_paginate_by_cursor = False
+    list_stream_results = False
     allowed_methods = ('GET',)
     mimetype_vendor = None
     mimetype_list_resource_name = None
@@ -710,18 +754,34 @@ class WebAPIResource(object):
              etag_if_none_match(request, etag))):
             return HttpResponseNotModified()
 
+        response_args = self.build_response_args(request)
 
+        def _build_response():
+            data = {
+                self.item_result_key: self.serialize_object(
+                    obj, request=request, *args, **kwargs),
+            }
 
-        data = {
-            self.item_result_key: self.serialize_object(obj, request=request,
-                                                        *args, **kwargs),
-        }
-
-        response = WebAPIResponse(request,
+            return WebAPIResponse(request,
                                   status=200,
                                   obj=data,
                                   api_format=api_format,
-                                  **self.build_response_args(request))
+                                  **response_args)
+
+        if self.cache_responses and etag:
+            response = WebAPIResponse(request,
+                                      status=200,
+                                      api_format=api_format,
+                                      **response_args)
+
+            if not response.content_set:
+                response.content = cache_memoize(
+                    self._get_response_cache_key(request, response, etag),
+                    lambda: _build_response().content,
+                    expiration=self.response_cache_expiration)
+                response.content_set = True
+        else:
+            response = _build_response()
 
         if last_modified_timestamp:
             set_last_modified(response, last_modified_timestamp)
@@ -749,7 +809,21 @@ class WebAPIResource(object):
                                '200 results, you will need to make more '
                                'than one request, using the "next" '
                                'pagination link.',
-            }
+            },
+            'cursor': {
+                'type': str,
+                'description': 'An opaque value identifying the page of '
+                               'results to return. This is provided in '
+                               'the "next" and "prev" pagination links '
+                               'for lists that support it.',
+            },
+            'total-results': {
+                'type': bool,
+                'description': 'Whether to include the exact total number '
+                               'of results. Some lists only include it '
+                               'when requested, or report a recent '
+                               'count.',
+            },
         },
         allow_unknown=True
     )
@@ -785,6 +859,9 @@ class WebAPIResource(object):
                     lambda obj: get_resource_for_object(obj).serialize_object(
                         obj, request=request, *args, **kwargs),
                 extra_data=data,
+                total_results_mode=self.list_total_results_mode,
+                paginate_by_cursor=self.list_paginate_by_cursor,
+                stream_results=self.list_stream_results,
                 **self.build_response_args(request))
         else:
             return 200, data
@@ -936,18 +1013,7 @@ class WebAPIResource(object):
         expanded_resources = expand.split(',')
 
         for field in six.iterkeys(self.fields):
-            serialize_func = getattr(self, "serialize_%s_field" % field, None)
-
-            if serialize_func and six.callable(serialize_func):
-                value = serialize_func(obj, request=request)
-            else:
-                value = getattr(obj, field)
-
-                if isinstance(value, models.Manager):
-                    value = value.all()
-                elif isinstance(value, models.ForeignKey):
-                    value = value.get()
-
+            value = self._pop_serialized_field(obj, field, request)
             expand_field = field in expanded_resources
 
             if isinstance(value, models.Model) and not expand_field:
@@ -1159,20 +1225,99 @@ class WebAPIResource(object):
 
         return None
 
+    def _get_response_cache_key(self, request, response, etag):
+        """Returns the cache key for an encoded item response.
+
+        The key only depends on what can change the encoded response. The
+        host and path are included for the links in the payload.
+        """
+        expand = request.GET.get('expand', request.POST.get('expand', ''))
+        key_parts = [
+            etag,
+            response.mimetype,
+            response.callback or '',
+            expand,
+            request.build_absolute_uri(request.path),
+        ]
+
+        return 'webapi-response-%s-%s' % (
+            self.name,
+            sha1('\0'.join(key_parts).encode('utf-8')).hexdigest())
+
     def generate_etag(self, obj, fields, request):
-        """Generates an ETag from the serialized values of all given fields."""
-        values = []
+        """Generates an ETag from the serialized values of all given fields.
 
-        for field in fields:
-            serialize_func = getattr(self, "serialize_%s_field" % field, None)
+        On HTTP GETs, the values are kept on the request until the object is
+        serialized, so that serialize_object() doesn't compute them again.
+        """
+        if request is not None and request.method == 'GET':
+            try:
+                field_cache = request._djblets_webapi_serialized_fields
+            except AttributeError:
+                field_cache = {}
+                request._djblets_webapi_serialized_fields = field_cache
+        else:
+            field_cache = None
+
+        etag = sha1()
+
+        for field in sorted(fields):
+            value = self._serialize_field(obj, field, request)
+            etag.update(field.encode('utf-8'))
+            etag.update(b'\0')
+            etag.update(json.dumps(value, sort_keys=True,
+                                   default=self._encode_etag_value)
+                        .encode('utf-8'))
+            etag.update(b'\0')
+
+            if field_cache is not None:
+                # The object is kept along with the value, so that its ID
+                # can't be reused by another object before it's serialized.
+                field_cache[(id(self), id(obj), field)] = (obj, value)
+
+        return etag.hexdigest()
+
+    def _encode_etag_value(self, value):
+        """Encodes a field value that JSON can't for use in an ETag."""
+        if isinstance(value, models.Model):
+            return [value.pk, six.text_type(value)]
+        elif isinstance(value, QuerySet):
+            return list(value)
+        else:
+            return six.text_type(value)
 
-            if serialize_func and six.callable(serialize_func):
-                values.append(serialize_func(obj, request=request))
-            else:
-                values.append(six.text_type(getattr(obj, field)))
+    def _pop_serialized_field(self, obj, field, request):
+        """Returns the serialized value of a field on an object.
 
-        data = ':'.join(fields)
-        return sha1(data.encode('utf-8')).hexdigest()
+        If the value was computed by generate_etag(), it's removed from the
+        request and returned, rather than being serialized again.
+        """
+        field_cache = getattr(request, '_djblets_webapi_serialized_fields',
+                              None)
+
+        if field_cache:
+            try:
+                return field_cache.pop((id(self), id(obj), field))[1]
+            except KeyError:
+                pass
+
+        return self._serialize_field(obj, field, request)
+
+    def _serialize_field(self, obj, field, request):
+        """Returns the serialized value of a field on an object."""
+        serialize_func = getattr(self, "serialize_%s_field" % field, None)
+
+        if serialize_func and six.callable(serialize_func):
+            value = serialize_func(obj, request=request)
+        else:
+            value = getattr(obj, field)
+
+            if isinstance(value, models.Manager):
+                value = value.all()
+            elif isinstance(value, models.ForeignKey):
+                value = value.get()
+
+        return value
 
     def _build_named_url(self, name):
         """Builds a Django URL name from the provided name."""
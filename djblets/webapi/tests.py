@@ -24,10 +24,20 @@
 
 from __future__ import print_function, unicode_literals
 
+import json
+import warnings
+from collections import OrderedDict
+
+from django.contrib.admin.models import ADDITION, LogEntry
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache
 from django.test.client import RequestFactory
+from django.utils import six
 
 from djblets.testing.testcases import TestCase
+from djblets.webapi.core import (TOTAL_RESULTS_CACHED, TOTAL_RESULTS_NONE,
+                                 MultiEncoder, WebAPIEncoder,
+                                 WebAPIResponsePaginated, XMLEncoderAdapter)
 from djblets.webapi.decorators import (copy_webapi_decorator_data,
                                        webapi_login_required,
                                        webapi_permission_required,
@@ -510,6 +520,351 @@ class WebAPIErrorTests(TestCase):
         self.assertEqual(orig_error.headers, orig_headers)
 
 
+class MultiEncoderTests(TestCase):
+    def test_encode(self):
+        """Testing MultiEncoder.encode remembering encoders by type"""
+        class IntEncoder(WebAPIEncoder):
+            calls = 0
+
+            def encode(self, o, *args, **kwargs):
+                self.calls += 1
+
+                if isinstance(o, int):
+                    return o * 2
+
+                return None
+
+        class StrEncoder(IntEncoder):
+            def encode(self, o, *args, **kwargs):
+                self.calls += 1
+
+                if isinstance(o, six.text_type):
+                    return o.upper()
+
+                return None
+
+        int_encoder = IntEncoder()
+        str_encoder = StrEncoder()
+        encoder = MultiEncoder([int_encoder, str_encoder])
+
+        self.assertEqual(encoder.encode('a'), 'A')
+        self.assertEqual(encoder.encode('b'), 'B')
+        self.assertEqual(encoder.encode(1), 2)
+        self.assertEqual(encoder.encode(None), None)
+
+        # The int encoder is only tried once for strings.
+        self.assertEqual(int_encoder.calls, 3)
+        self.assertEqual(str_encoder.calls, 3)
+
+
+class XMLEncoderAdapterTests(TestCase):
+    def test_encode(self):
+        """Testing XMLEncoderAdapter.encode"""
+        adapter = XMLEncoderAdapter(WebAPIEncoder())
+        content = adapter.encode(OrderedDict([
+            ('items', ['<a> & b', 1, True, None, '']),
+            ('counts', {
+                2: 3,
+            }),
+            ('stat', 'ok'),
+        ]))
+
+        self.assertEqual(
+            content.decode('utf-8'),
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<rsp>\n'
+            ' <items>\n'
+            '  <array>\n'
+            '   <item>&lt;a&gt; &amp; b</item>\n'
+            '   <item>1</item>\n'
+            '   <item>1</item>\n'
+            '   <item>\n'
+            '   </item>\n'
+            '   <item></item>\n'
+            '  </array>\n'
+            ' </items>\n'
+            ' <counts>\n'
+            '  <int value="2">3</int>\n'
+            ' </counts>\n'
+            ' <stat>ok</stat>\n'
+            '</rsp>')
+
+    def test_encode_without_indent(self):
+        """Testing XMLEncoderAdapter.encode with indent=False"""
+        adapter = XMLEncoderAdapter(WebAPIEncoder(), indent=False)
+        content = adapter.encode({'items': [{'a': 'b'}]})
+
+        self.assertEqual(
+            content.decode('utf-8'),
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<rsp><items><array><item><a>b</a></item></array></items></rsp>')
+
+    def test_encode_unsupported(self):
+        """Testing XMLEncoderAdapter.encode with unsupported objects"""
+        adapter = XMLEncoderAdapter(WebAPIEncoder())
+        self.assertRaises(TypeError, adapter.encode, {'a': object()})
+
+    def test_iterencode(self):
+        """Testing XMLEncoderAdapter.iterencode with a generator"""
+        generated = []
+
+        def gen_items():
+            for i in range(3):
+                generated.append(i)
+                yield i
+
+        adapter = XMLEncoderAdapter(WebAPIEncoder(), indent=False)
+        chunks = adapter.iterencode({'items': gen_items()})
+
+        self.assertTrue('<rsp><items><array><item>0</item>' in next(chunks))
+        self.assertEqual(generated, [0])
+        self.assertEqual(''.join(chunks),
+                         '<item>1</item><item>2</item></array></items></rsp>')
+
+
+class WebAPIResponsePaginatedTests(TestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+        for i in range(5):
+            User.objects.create(username='user%d' % i)
+
+        self.queryset = User.objects.order_by('pk')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_exact_total_results(self):
+        """Testing WebAPIResponsePaginated with TOTAL_RESULTS_EXACT"""
+        request = self.factory.get('/api/users/?max-results=2')
+
+        with self.assertNumQueries(2):
+            response = WebAPIResponsePaginated(request, self.queryset,
+                                               extra_data={'links': {}})
+
+        self.assertEqual(response.api_data['total_results'], 5)
+        self.assertEqual(len(response.api_data['results']), 2)
+        self.assertTrue('next' in response.api_data['links'])
+
+    def test_no_total_results(self):
+        """Testing WebAPIResponsePaginated with TOTAL_RESULTS_NONE"""
+        request = self.factory.get('/api/users/?start=2&max-results=2')
+
+        with self.assertNumQueries(1):
+            response = WebAPIResponsePaginated(
+                request, self.queryset, extra_data={'links': {}},
+                total_results_mode=TOTAL_RESULTS_NONE)
+
+        self.assertFalse('total_results' in response.api_data)
+        self.assertEqual([user.username
+                          for user in response.api_data['results']],
+                         ['user2', 'user3'])
+        self.assertTrue('prev' in response.api_data['links'])
+        self.assertTrue('next' in response.api_data['links'])
+
+        request = self.factory.get('/api/users/?start=3&max-results=2')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            total_results_mode=TOTAL_RESULTS_NONE)
+        self.assertEqual(len(response.api_data['results']), 2)
+        self.assertFalse('next' in response.api_data['links'])
+
+    def test_requested_total_results(self):
+        """Testing WebAPIResponsePaginated with total-results=1"""
+        request = self.factory.get('/api/users/?total-results=1')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            total_results_mode=TOTAL_RESULTS_NONE)
+        self.assertEqual(response.api_data['total_results'], 5)
+
+    def test_cached_total_results(self):
+        """Testing WebAPIResponsePaginated with TOTAL_RESULTS_CACHED"""
+        request = self.factory.get('/api/users/')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            total_results_mode=TOTAL_RESULTS_CACHED)
+        self.assertEqual(response.api_data['total_results'], 5)
+
+        User.objects.create(username='user5')
+
+        with self.assertNumQueries(1):
+            response = WebAPIResponsePaginated(
+                request, self.queryset, extra_data={'links': {}},
+                total_results_mode=TOTAL_RESULTS_CACHED)
+
+        self.assertEqual(response.api_data['total_results'], 5)
+        self.assertEqual(len(response.api_data['results']), 6)
+
+    def test_cursor_pagination(self):
+        """Testing WebAPIResponsePaginated with paginate_by_cursor"""
+        queryset = User.objects.order_by('-username')
+        request = self.factory.get('/api/users/?max-results=2')
+        pages = []
+
+        while request:
+            with self.assertNumQueries(1):
+                response = WebAPIResponsePaginated(
+                    request, queryset, extra_data={'links': {}},
+                    total_results_mode=TOTAL_RESULTS_NONE,
+                    paginate_by_cursor=True)
+
+            links = response.api_data['links']
+            pages.append([user.username
+                          for user in response.api_data['results']])
+            self.assertEqual('prev' in links, len(pages) > 1)
+
+            if 'next' in links:
+                self.assertTrue('cursor=' in links['next']['href'])
+                request = self.factory.get(links['next']['href'])
+            else:
+                request = None
+
+        self.assertEqual(pages, [['user4', 'user3'], ['user2', 'user1'],
+                                 ['user0']])
+
+        # Follow the prev link back from the last page.
+        request = self.factory.get(links['prev']['href'])
+        response = WebAPIResponsePaginated(
+            request, queryset, extra_data={'links': {}},
+            paginate_by_cursor=True)
+        self.assertEqual([user.username
+                          for user in response.api_data['results']],
+                         ['user2', 'user1'])
+        self.assertEqual(response.api_data['total_results'], 5)
+        self.assertTrue('prev' in response.api_data['links'])
+        self.assertTrue('next' in response.api_data['links'])
+
+    def test_cursor_pagination_invalid_cursor(self):
+        """Testing WebAPIResponsePaginated with an invalid cursor"""
+        request = self.factory.get('/api/users/?cursor=abc&max-results=2')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            paginate_by_cursor=True)
+        self.assertEqual([user.username
+                          for user in response.api_data['results']],
+                         ['user0', 'user1'])
+        self.assertFalse('prev' in response.api_data['links'])
+
+    def test_cursor_pagination_with_nullable_field(self):
+        """Testing WebAPIResponsePaginated cursors with a nullable field"""
+        user = User.objects.get(username='user0')
+
+        for object_id in (None, '1', None):
+            LogEntry.objects.create(user=user, object_id=object_id,
+                                    object_repr='', action_flag=ADDITION)
+
+        request = self.factory.get('/api/logs/?max-results=2')
+        response = WebAPIResponsePaginated(
+            request, LogEntry.objects.order_by('object_id'),
+            extra_data={'links': {}}, paginate_by_cursor=True)
+
+        # NULL values can't be filtered on, so start is used instead.
+        self.assertTrue('start=2' in
+                        response.api_data['links']['next']['href'])
+
+    def test_cursor_pagination_with_relation(self):
+        """Testing WebAPIResponsePaginated cursors with a relation"""
+        for user in User.objects.all():
+            LogEntry.objects.create(user=user, object_repr='',
+                                    action_flag=ADDITION)
+
+        request = self.factory.get('/api/logs/?max-results=2')
+        response = WebAPIResponsePaginated(
+            request, LogEntry.objects.order_by('user'),
+            extra_data={'links': {}}, paginate_by_cursor=True)
+
+        # Relations are ordered by the related model's ordering, which
+        # doesn't match the values in a cursor, so start is used instead.
+        self.assertTrue('start=2' in
+                        response.api_data['links']['next']['href'])
+
+    def test_cursor_pagination_with_extra_order_by(self):
+        """Testing WebAPIResponsePaginated cursors with extra(order_by=)"""
+        request = self.factory.get('/api/users/?max-results=2')
+        response = WebAPIResponsePaginated(
+            request, User.objects.extra(order_by=['-username']),
+            extra_data={'links': {}}, paginate_by_cursor=True)
+        self.assertEqual([user.username
+                          for user in response.api_data['results']],
+                         ['user4', 'user3'])
+
+        # The extra ordering can't be used for cursors, so start is used
+        # instead.
+        self.assertTrue('start=2' in
+                        response.api_data['links']['next']['href'])
+
+    def test_stream_results(self):
+        """Testing WebAPIResponsePaginated with stream_results"""
+        serialized = []
+
+        def serialize_object(user):
+            serialized.append(user)
+
+            return {'username': user.username}
+
+        request = self.factory.get('/api/users/?max-results=2&callback=cb',
+                                   HTTP_ACCEPT='application/json')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            serialize_object_func=serialize_object, stream_results=True)
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(serialized, [])
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(serialized), 2)
+        self.assertTrue(content.startswith('cb('))
+        self.assertTrue(content.endswith(');'))
+        self.assertEqual(
+            json.loads(content[3:-2]),
+            {
+                'stat': 'ok',
+                'total_results': 5,
+                'results': [
+                    {'username': 'user0'},
+                    {'username': 'user1'},
+                ],
+                'links': {
+                    'next': {
+                        'method': 'GET',
+                        'href': 'http://testserver/api/users/'
+                                '?start=2&max-results=2',
+                    },
+                },
+            })
+
+    def test_stream_results_xml(self):
+        """Testing WebAPIResponsePaginated with stream_results and XML"""
+        request = self.factory.get('/api/users/?max-results=2',
+                                   HTTP_ACCEPT='application/xml')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            serialize_object_func=lambda user: user.username,
+            stream_results=True)
+
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertTrue('<item>user0</item>' in content)
+        self.assertTrue('<item>user1</item>' in content)
+
+    def test_stream_results_iter(self):
+        """Testing WebAPIResponsePaginated with stream_results when iterated"""
+        request = self.factory.get('/api/users/?max-results=2',
+                                   HTTP_ACCEPT='application/json')
+        response = WebAPIResponsePaginated(
+            request, self.queryset, extra_data={'links': {}},
+            serialize_object_func=lambda user: user.username,
+            stream_results=True)
+
+        self.assertRaises(AttributeError, lambda: response.content)
+
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            content = b''.join(response).decode('utf-8')
+
+        self.assertEqual(w, [])
+        self.assertEqual(json.loads(content)['results'], ['user0', 'user1'])
+
+
 class WebAPIResourceTests(TestCase):
     def setUp(self):
         self.factory = RequestFactory()
@@ -705,6 +1060,120 @@ class WebAPIResourceTests(TestCase):
             view_kwargs={'id': 1},
             method='delete')
 
+    def test_get_with_cache_responses(self):
+        """Testing WebAPIResource with GET and cache_responses"""
+        class TestResource(WebAPIResource):
+            model = User
+            fields = {
+                'username': {
+                    'type': str,
+                },
+            }
+            uri_object_key = 'user_id'
+            etag_field = 'username'
+            cache_responses = True
+
+            def serialize_object(self, *args, **kwargs):
+                serialize_calls.append(True)
+
+                return super(TestResource, self).serialize_object(
+                    *args, **kwargs)
+
+            def get_links(self, *args, **kwargs):
+                return {}
+
+        serialize_calls = []
+        user = User.objects.create(username='test-user')
+        self.test_resource = TestResource()
+
+        for i in range(2):
+            request = self.factory.get('/api/tests/%s/' % user.pk,
+                                       HTTP_ACCEPT='application/json')
+            request.user = AnonymousUser()
+            response = self.test_resource(request, user_id=user.pk)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(response['ETag'], 'test-user')
+            self.assertEqual(
+                json.loads(response.content.decode('utf-8')),
+                {
+                    'stat': 'ok',
+                    'user': {
+                        'links': {},
+                        'username': 'test-user',
+                    },
+                })
+
+        self.assertEqual(len(serialize_calls), 1)
+
+        # Requests for other mimetypes have their own cached responses.
+        request = self.factory.get('/api/tests/%s/' % user.pk,
+                                   HTTP_ACCEPT='application/xml')
+        request.user = AnonymousUser()
+        response = self.test_resource(request, user_id=user.pk)
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        self.assertEqual(len(serialize_calls), 2)
+
+        # Query parameters that don't change the response share it.
+        request = self.factory.get('/api/tests/%s/?_=123' % user.pk,
+                                   HTTP_ACCEPT='application/json')
+        request.user = AnonymousUser()
+        response = self.test_resource(request, user_id=user.pk)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(len(serialize_calls), 2)
+
+        request = self.factory.get('/api/tests/%s/?callback=cb' % user.pk,
+                                   HTTP_ACCEPT='application/json')
+        request.user = AnonymousUser()
+        response = self.test_resource(request, user_id=user.pk)
+        self.assertTrue(response.content.startswith(b'cb('))
+        self.assertEqual(len(serialize_calls), 3)
+
+    def test_generate_etag(self):
+        """Testing WebAPIResource.generate_etag with changed field values"""
+        class TestResource(WebAPIResource):
+            model = User
+            fields = {
+                'username': {
+                    'type': str,
+                },
+                'email': {
+                    'type': str,
+                },
+            }
+            uri_object_key = 'user_id'
+            autogenerate_etags = True
+
+            def serialize_email_field(self, obj, **kwargs):
+                serialize_calls.append(obj)
+
+                return obj.email
+
+            def get_links(self, *args, **kwargs):
+                return {}
+
+        serialize_calls = []
+        user = User.objects.create(username='test-user',
+                                   email='test@example.com')
+        self.test_resource = TestResource()
+
+        request = self.factory.get('/api/tests/%s/' % user.pk)
+        request.user = AnonymousUser()
+        response = self.test_resource(request, user_id=user.pk)
+        etag = response['ETag']
+        self.assertEqual(len(serialize_calls), 1)
+
+        # The values computed for the ETag are released once used.
+        self.assertEqual(request._djblets_webapi_serialized_fields, {})
+
+        request = self.factory.get('/api/tests/%s/' % user.pk)
+        self.assertEqual(self.test_resource.get_etag(request, user), etag)
+
+        user.email = 'test2@example.com'
+        request = self.factory.get('/api/tests/%s/' % user.pk)
+        self.assertNotEqual(self.test_resource.get_etag(request, user), etag)
+
     def _test_mimetype_responses(self, resource, url, json_mimetype,
                                  xml_mimetype, **kwargs):
         self._test_mimetype_response(resource, url, '*/*', json_mimetype,